@@ -12,8 +12,10 @@ order to produce all possible solutions from a given Sudoku
 puzzle. For a complete explanation of the method, see
 arXiv:cs/0011047.
 
-This module can only handle n-values between 1 and 35; said limitation
-stems from the add_filled_cell function.
+Grids of up to 35 x 35 are written one character per cell, with the
+digits 1 through 9 and then the letters A through Z. Larger grids, up
+to 255 x 255, are written with their cells in decimal and separated by
+commas; see grid_cells and format_grid.
 
 --------------------------- A note on terminology -----------------------------
 
@@ -62,8 +64,28 @@ True
 
 """
 
+import os
+import sys
+import time
+import json
+import zlib
+import mmap
+import struct
+import uuid
+import random
+import threading
+import itertools
+from array import array
+from collections import OrderedDict
+
 _DIGITS = "123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ"
 
+# Separates the cells of a grid too large for one character per cell.
+_SEPARATOR = ","
+
+# The largest n; get_bytes and set_cells hold each digit in a byte.
+_MAX_N = 255
+
 # Default arguments for a standard 9 x 9 Sudoku grid.
 _N = 9
 _BOX_WIDTH = 3
@@ -78,7 +100,13 @@ _NUMSOLS = 2
 # Uncomment if you want to find all solutions.
 # _NUMSOLS = float('inf')
 
-def find_solutions(L, n=9, boxWidth=3, numSols=_NUMSOLS):
+# Name of the exact cover engine used by find_solutions. See ENGINES.
+_ENGINE = 'links'
+
+def find_solutions(L, n=9, boxWidth=3, numSols=_NUMSOLS, engine=_ENGINE,
+                   pool=None, propagate=False, stats=None,
+                   maxNodes=None, deadline=None, cache=None, tracer=None,
+                   cancel=None, hint=None):
     """Solve an n by n Sudoku grid represented by the list or string L.
 
     In its current form, find_solutions(L) will simply print all
@@ -97,17 +125,247 @@ def find_solutions(L, n=9, boxWidth=3, numSols=_NUMSOLS):
     numSols: the number of solutions to find before halting. Use
     float('inf') if you want to find all solutions.
 
+    engine: the name of the exact cover implementation to search
+    with. 'links' is the SudokuMatrix object graph, 'array' is the
+    ArrayMatrix. Both produce identical output. 'backjump' counts
+    solutions by conflict-directed backjumping; see BackjumpSearch.
+
+    pool: an optional MatrixPool to borrow a prebuilt matrix from. When
+    given, the pool's engine is used instead of engine.
+
+    propagate: if True, fill in naked and hidden singles with
+    propagate_singles before searching. Grids which propagation proves
+    contradictory are never searched.
+
+    stats: an optional dict. It is filled in with the counters and
+    timings of a SearchStats describing the search, with 'cached' set if
+    the answer came from cache; no search is made then, so its counters
+    and timings are all zero. If propagate is True, stats['settled'] is
+    set to the number of cells propagation filled in. Without stats,
+    nothing is counted.
+
+    maxNodes: the number of search nodes to visit before giving up.
+
+    deadline: the time, as returned by time.time(), at which to give up.
+
+    If the search gives up, the original grid is returned. Use analyze to
+    tell a search which gave up from one which found no unique solution.
+
+    cache: an optional SolutionCache consulted before searching, and
+    filled in afterwards, when numSols is at least two. Grids with
+    several solutions are only answered from it when numSols is two.
+
+    tracer: an optional Tracer told of every step of the search.
+
+    cancel: an optional threading.Event; once it is set, the search gives
+    up as if it had run out of time. See Search.run.
+
+    hint: an optional grid, such as the solution of a grid which differs
+    from L in a cell or two. Within each Constraint, the Candidate agreeing
+    with it is tried first. The answer is the same with or without it.
+
+    >>> stats = {}
+    >>> find_solutions(_EMPTY_GRID, propagate=True, stats=stats) == '0'*81
+    True
+    >>> stats['settled'], stats['nodes'], stats['maxDepth']
+    (0, 88, 81)
+
     """
-    solver = SudokuMatrix(L, n, boxWidth, numSols)
-    solutions = solver.solve()
-    
+    result = analyze(L, n, boxWidth, numSols, engine, pool, propagate,
+                     maxNodes, deadline, cache, stats is not None, tracer,
+                     cancel, hint)
+    if stats is not None:
+        stats.update(result.stats.as_dict())
+        stats['cached'] = result.cached
+    if propagate and stats is not None:
+        stats['settled'] = result.settled
+
     # Print solution if unique.
-    if solutions[1:] == []:
-        return solutions[0]
+    if not result.exhausted and result.count == 1:
+        return result.solution
 
     # If no unique solution, return original grid.
     else:
-        return solver.original_grid
+        return L
+
+def analyze(L, n=9, boxWidth=3, numSols=_NUMSOLS, engine=_ENGINE,
+            pool=None, propagate=False, maxNodes=None, deadline=None,
+            cache=None, stats=False, tracer=None, cancel=None, hint=None):
+    """Search the grid L and return a SolveResult describing it.
+
+    The arguments are those of find_solutions, except that stats is a
+    boolean: if True, the result's stats is a SearchStats. The result
+    tells whether L has a unique solution, several, none, or whether the
+    search ran out of nodes or time before it could tell.
+
+    >>> analyze('0' * 80 + '9').status
+    'multiple'
+    >>> result = analyze('0' * 80 + '9', maxNodes=50)
+    >>> result.status, result.nodes
+    ('unknown', 50)
+    >>> analyze('55' + '0' * 79, propagate=True).status
+    'none'
+
+    """
+    started = time.time()
+    result = SolveResult(numSols)
+    searchStats = None
+    if stats:
+        searchStats = result.stats = SearchStats()
+
+    # Only the question of uniqueness is shared between equivalent grids;
+    # which solution is found first is not.
+    canonical = None
+    if cache is not None and numSols >= 2:
+        canonical = canonical_form(L, n, boxWidth)
+    if canonical is not None:
+        key, transform = canonical
+        hit, entry = cache.get((n, boxWidth, key))
+        # Several solutions are stored as two, which is only the count
+        # of a search stopping at two.
+        if hit and (entry[0] < 2 or numSols == 2):
+            result.cached = True
+            count, solution = entry
+            if solution is not None:
+                solution = from_canonical(solution, n, transform)
+            return result.finish(count, solution, False, started)
+
+        result = analyze(L, n, boxWidth, numSols, engine, pool, propagate,
+                         maxNodes, deadline, None, stats, tracer, cancel,
+                         hint)
+        if result.status == UNIQUE:
+            solution = canonical_solution(result.solution, n, transform)
+            cache.put((n, boxWidth, key), (1, solution))
+        elif result.status == MULTIPLE and numSols == 2:
+            cache.put((n, boxWidth, key), (2, None))
+        elif result.status == NONE:
+            cache.put((n, boxWidth, key), (0, None))
+        return result
+
+    grid = L
+    lap = time.time()
+    if propagate:
+        try:
+            grid, result.settled = propagate_singles(L, n, boxWidth)
+        except CellViolation:
+            # Leave the faulty cell for set_grid to report.
+            grid = L
+        if searchStats is not None:
+            lap = searchStats.lap('propagate', lap)
+
+        # Propagation found a contradiction.
+        if grid is None:
+            return result.finish(0, None, False, started)
+
+        # Propagation alone filled the grid, so the solution is unique.
+        if 0 not in grid:
+            solution = format_grid(grid, n)
+            return result.finish(1, solution, False, started)
+
+    if pool is not None:
+        solver = pool.checkout(n, boxWidth)
+    elif searchStats is None:
+        solver = ENGINES[engine](grid, n, boxWidth, numSols)
+    else:
+        # Build the empty matrix first, so that set_grid is timed apart.
+        solver = ENGINES[engine]("0" * n**2, n, boxWidth, numSols)
+    try:
+        if searchStats is not None:
+            lap = searchStats.lap('setup', lap)
+        if pool is not None or searchStats is not None:
+            solver.load(grid, numSols)
+        if searchStats is not None:
+            lap = searchStats.lap('setGrid', lap)
+
+        search = solver.counting_search(probe(solver, searchStats, tracer),
+                                        hint=hint)
+        search.run(maxNodes, deadline, cancel)
+        if tracer is not None:
+            tracer.flush()
+        if searchStats is not None:
+            searchStats.nodes = search.nodes
+            lap = searchStats.lap('search', lap)
+
+        # Render the solution only once it is the only one found.
+        solution = None
+        if search.count == 1:
+            solution = solver.get_string(search.first)
+        if searchStats is not None:
+            searchStats.lap('render', lap)
+    finally:
+        if pool is not None:
+            pool.checkin(solver)
+
+    result.nodes = search.nodes
+    return result.finish(search.count, solution, search.exhausted, started)
+
+def count_solutions(L, n=9, boxWidth=3, limit=float('inf'),
+                    engine=_ENGINE):
+    """Return the number of solutions of L, counting no further than limit.
+
+    >>> count_solutions('0' * 80 + '9', limit=3)
+    3
+
+    """
+    return ENGINES[engine](L, n, boxWidth).count_solutions(limit)
+
+def is_unique(L, n=9, boxWidth=3, engine=_ENGINE):
+    """Return True if the grid L has exactly one solution."""
+    return ENGINES[engine](L, n, boxWidth).is_unique()
+
+def iter_solutions(L, n=9, boxWidth=3, numSols=float('inf'),
+                   engine=_ENGINE, encoding='string'):
+    """Yield the solutions of the grid L one at a time.
+
+    See SudokuMatrix.iter_solutions.
+
+    >>> solutions = iter_solutions('0' * 80 + '9', encoding='bytes')
+    >>> [ord(digit) for digit in next(solutions)[:9]]
+    [1, 2, 3, 4, 5, 6, 9, 7, 8]
+
+    """
+    matrix = ENGINES[engine](L, n, boxWidth)
+    return matrix.iter_solutions(numSols, encoding)
+
+def pencil_marks(L, n=9, boxWidth=3, engine=_ENGINE, pool=None,
+                 propagate=False):
+    """Return the candidates left in every cell of the grid L.
+
+    Returns a tuple (grid, masks, forced): grid is L as a string, masks
+    the candidate_masks of its cells, and forced its forced_cells. With
+    propagate, naked and hidden singles are filled in first, and grid
+    holds them. If propagation finds a contradiction, None is returned.
+
+    pool and engine are as for find_solutions.
+
+    >>> grid, masks, forced = pencil_marks('12345678' + '0'*73)
+    >>> bin(masks[8]), forced
+    ('0b100000000', [(0, 8, 9)])
+    >>> grid, masks, forced = pencil_marks('12345678' + '0'*73,
+    ...                                    propagate=True)
+    >>> grid[:9], masks[8], forced[:1]
+    ('123456789', 0, [])
+    >>> pencil_marks('55' + '0'*79, propagate=True) is None
+    True
+
+    """
+    if propagate:
+        L, settled = propagate_singles(L, n, boxWidth)
+        if L is None:
+            return None
+
+    if pool is not None:
+        matrix = pool.checkout(n, boxWidth)
+        matrix.set_grid(L)
+    else:
+        matrix = ENGINES[engine](L, n, boxWidth)
+
+    try:
+        masks = matrix.candidate_masks()
+        return matrix.get_string(), masks, matrix.forced_cells(masks)
+    finally:
+        if pool is not None:
+            pool.checkin(matrix)
 
 class SudokuMatrix:
     """A sparse matrix representing a Sudoku grid.
@@ -141,7 +399,8 @@ class SudokuMatrix:
 
         n: the number of rows, columns, boxes, and different numbers
         in the grid. The majority of Sudoku grids choose n =
-        9. Currently, n is limited to the xrange [1,36).
+        9. n is limited to the xrange [2, _MAX_N]; above 35, grids
+        are written in the delimited form of format_grid.
 
         boxWidth: the horizontal width of each box in the grid. If n
         does not equal 9, a boxWidth must be specified. The majority
@@ -150,7 +409,7 @@ class SudokuMatrix:
         numSols: the number of solutions to find before halting.
 
         """
-        assert(1 < n < 35)
+        assert(1 < n <= _MAX_N)
         assert(n % boxWidth == 0)
 
         self.n = n
@@ -199,13 +458,20 @@ class SudokuMatrix:
         # A list containing the Candidates which have so far been chosen.
         self.choices = []
 
+        # Set once a filled cell contradicts an earlier one. Such a matrix
+        # can no longer be restored by unwinding its choices.
+        self.tainted = False
+
+        # Maps each Constraint to its number; built by constraint_number.
+        self.constraintNumbers = None
+
         for i in xrange(self.n):
             for j in xrange(self.n):
 
-                self.celConstraints.append(Constraint(self))
-                self.rowConstraints.append(Constraint(self))
-                self.colConstraints.append(Constraint(self))
-                self.boxConstraints.append(Constraint(self))
+                self.celConstraints.append(self.new_constraint())
+                self.rowConstraints.append(self.new_constraint())
+                self.colConstraints.append(self.new_constraint())
+                self.boxConstraints.append(self.new_constraint())
 
         for row in xrange(self.n):
             for col in xrange(self.n):
@@ -217,6 +483,10 @@ class SudokuMatrix:
                 for num in xrange(self.n):
                     self.candidates.append(Candidate(self, row, col, box, num))
 
+    def new_constraint(self):
+        """Create a Constraint and link it into the matrix."""
+        return Constraint(self)
+
     def __str__(self):
         """Represent the partial solution as a two-dimensional Sudoku grid."""
         n = self.n
@@ -228,45 +498,79 @@ class SudokuMatrix:
         return ("SudokuMatrix(original_grid='%s', n=%d, boxWidth=%d)" %
                 (self.get_string(), self.n, self.boxWidth))
 
-    def get_string(self):
-        """Represent the partial solution as a string of n**2 characters."""
-        choices = sorted(self.choices)
+    def get_bytes(self, choices=None):
+        """Represent the partial solution as a string of n**2 bytes.
 
-        s = ""
-        loc = 0                        # Number of current cell being displayed
-        candidate = 0                     # Number of next Candidate to display
-        numCandidates = len(choices)
-        
-        for row in xrange(self.n):
-            for col in xrange(self.n):
+        Each byte holds the digit in its cell, or 0 for an empty cell, so
+        that solutions can be written out without being formatted.
 
-                # solution[candidate][0] is the number of the next solved cell.
-                if  ( (candidate < numCandidates) and
-                      (loc == choices[candidate][0]) ):
-                    s += _DIGITS[choices[candidate][1].num]
-                    candidate += 1
-                else:
-                    s += "0"
+        >>> map(ord, SudokuMatrix('12' + '0' * 79).get_bytes()[:3])
+        [1, 2, 0]
 
-                loc += 1
-        return s
+        """
+        if choices is None:
+            choices = self.choices
+
+        n = self.n
+        cells = bytearray(n**2)
+        for choice in choices:
+            index = self.chosen_index(choice)
+            cells[index // n] = index % n + 1
+        return str(cells)
+
+    def get_string(self, choices=None):
+        """Represent the partial solution as a string of n**2 characters.
+
+        choices defaults to the Candidates chosen so far; a copy of
+        self.choices taken earlier may be given instead.
+
+        """
+        if choices is None:
+            choices = self.choices
+
+        n = self.n
+        cells = [0] * n**2
+        for choice in choices:
+            index = self.chosen_index(choice)
+            cells[index // n] = index % n + 1
+        return format_grid(cells, n)
+
+    def load(self, original_grid, numSols=_NUMSOLS):
+        """Replace the puzzle held by the matrix with original_grid."""
+        self.original_grid = original_grid
+        self.numSols = numSols
+        self.set_grid(original_grid)
 
     def set_grid(self, s):
         """Adds the filled cells provided by the Sudoku puzzle.
 
         s must be a string or list of length n**2 composed of integers
-        between 0 and n.
+        between 0 and n, or a grid in the delimited form of format_grid.
 
         Each element of s corresponds to a cell in the Sudoku grid,
         going left to right then top to bottom. 0 denotes an empty cell.
 
+        s may also be a bytearray, buffer, or memoryview holding one byte
+        per cell, such as a record of a sudoku_records file. Such cells
+        are read as integers directly rather than through parse_digit.
+
+        >>> foo = SudokuMatrix()
+        >>> foo.set_grid(bytearray([1, 2]) + bytearray(79))
+        >>> foo.get_string() == '12' + '0'*79
+        True
+
         """
+        s = grid_cells(s, self.n)
         assert(len(s) == self.n**2)
 
         # reset the matrix if its grid has been set already.
         while self.choices != []:
             self.backtrack()
 
+        if isinstance(s, (bytearray, buffer, memoryview)):
+            self.set_cells(bytearray(s))
+            return
+
         for row in xrange(self.n):
             for col in xrange(self.n):
                 digit = s[row * self.n + col]
@@ -275,13 +579,32 @@ class SudokuMatrix:
                 except CellViolation as e:
                     print e
 
+    def set_cells(self, cells):
+        """Fill in the cells of a sequence of n**2 integers.
+
+        This is the fast path of set_grid: the matrix must hold no
+        Candidates yet, and cells are not parsed.
+
+        """
+        n = self.n
+        for location, digit in enumerate(cells):
+            if digit == 0:
+                continue
+            if digit > n:
+                print CellViolation(location // n, location % n, digit, n)
+                continue
+
+            index = location * n + digit - 1
+            if not self.is_available(index):
+                self.tainted = True
+            self.choose(index)
+
     def add_filled_cell(self, row, col, digit):
         """Add a filled cell to the calling SudokuMatrix's solution.
 
         Handles string and integer inputs well enough for most Sudoku
-        puzzles found in the wild. Assumes all inputs are in base n + 1.
-        Since string to integer conversion relies on Python's int function,
-        this module only supports n <= 35.
+        puzzles found in the wild. Single characters are read in base
+        n + 1 while n <= 35, and in base 10 beyond; see parse_digit.
 
         Keyword Arguments:
 
@@ -297,12 +620,7 @@ class SudokuMatrix:
         2
 
         """
-        if type(digit) == type(str()):
-            # give user the benefit of the doubt that digit <= n.
-            if len(digit) > 1:
-                digit = int(digit)
-            else:
-                digit = int(digit, self.n + 1)
+        digit = parse_digit(digit, self.n)
 
         # Return if the cell is empty.
         if digit == 0:
@@ -313,61 +631,284 @@ class SudokuMatrix:
 
         num = digit - 1
 
+        index = row * self.n**2 + col * self.n + num
+        if not self.is_available(index):
+            self.tainted = True
+
         # Add the represented Candidate to the partial solution.
-        x = self.candidates[row * self.n**2 + col * self.n + num]
-        x.choose(self)
+        self.choose(index)
 
-    def solve(self, solutions=None, depth=0):
-        """Solve the puzzle and call self.__solution_found()."""
-        
-        if solutions == None:
-            solutions = []
+    def remove_filled_cell(self, row, col):
+        """Remove the filled cell at (row, col) from the partial solution.
+
+        Unlike backtrack, the cell need not be the last one filled: every
+        cell filled after it is taken out and then put back in order, so
+        the matrix is restored exactly. Returns False if the cell was not
+        filled.
 
-        # Base Case: backtrack to start if no more solutions are desired.
-        if self.numSols <= 0:
+        >>> foo = SudokuMatrix('12' + '0'*79)
+        >>> foo.remove_filled_cell(0, 0)
+        True
+        >>> foo.get_string() == '02' + '0'*79
+        True
+
+        """
+        location = row * self.n + col
+        locations = [choice[0] for choice in self.choices]
+        if location not in locations:
+            return False
+
+        redo = []
+        while len(self.choices) > locations.index(location) + 1:
+            redo.append(self.chosen_index(self.choices[-1]))
             self.backtrack()
-            return solutions
+        self.backtrack()
 
-        # Success base case: matrix is empty.
-        elif self.root.right == self.root:
-            return self.__solution_found(solutions)
+        for index in reversed(redo):
+            self.choose(index)
+        return True
 
-        else:
-            selectedConstraint = self.chosen_constraint()
-            
-            # Failure base: logical contradiction found.
-            if selectedConstraint.size <= 0:
-                self.backtrack()
-                return solutions
+    def chosen_index(self, choice):
+        """Return the Candidate number of an entry of self.choices."""
+        candidate = choice[1]
+        return candidate.location * self.n + candidate.num
+
+    def cell_constraint(self, location):
+        """Return the Constraint that the cell at location be filled."""
+        return self.celConstraints[location]
 
-            selectedNode = selectedConstraint.down
+    def constraint_number(self, constraint):
+        """Return the number of constraint, as numbered by ArrayMatrix.
 
-            # Try all Candidates intersecting this Constraint.
-            while selectedNode != selectedConstraint:
+        The cell, row, column, and box Constraints of the kth place are
+        numbered 1 + 4 * k through 4 + 4 * k.
 
-                selectedNode.candidate.choose(self)
+        """
+        if self.constraintNumbers is None:
+            numbers = {}
+            lists = (self.celConstraints, self.rowConstraints,
+                     self.colConstraints, self.boxConstraints)
+            for kind, constraints in enumerate(lists):
+                for k, c in enumerate(constraints):
+                    numbers[c] = 1 + 4 * k + kind
+            self.constraintNumbers = numbers
+        return self.constraintNumbers[constraint]
+
+    def is_available(self, index):
+        """Return True if no chosen Candidate rules out Candidate index."""
+        x = self.candidates[index]
+        return (x.legal_cell() and x.legal_row() and
+                x.legal_column() and x.legal_box())
+
+    def choose(self, index):
+        """Add the Candidate numbered index to the partial solution.
+
+        Candidates are numbered row * n**2 + col * n + num.
+
+        """
+        self.candidates[index].choose(self)
 
-                # Recurse to fully explore this branch.
-                self.solve(solutions, depth + 1)
+    def choose_counted(self, index):
+        """Choose the Candidate numbered index as choose does.
 
-                # After the maximum depth has been reached by
-                # recursion, try the next Candidate.
-                selectedNode = selectedNode.down
+        Returns a tuple (covers, unlinks) of the number of Constraints
+        covered and of Nodes unlinked. Every Candidate has four Nodes, so
+        covering a Constraint unlinks three Nodes beside each Node beneath
+        it.
 
-            # Every choice below this depth has been made.
-            if depth > 0:
-                self.backtrack()
+        """
+        x = self.candidates[index]
+        self.choices.append((x.location, x))
+
+        covers = unlinks = 0
+        node = x.right
+        while node != x:
+            constraint = node.constraint
+            if not constraint.covered:
+                covers += 1
+                unlinks += 3 * constraint.size
+                constraint.cover()
+            node = node.right
+        return covers, unlinks
+
+    def solve(self, stats=None, tracer=None):
+        """Solve the puzzle, returning up to numSols solutions.
+
+        The search is carried out by a Search, which backtracks only the
+        choices it made; the matrix is left holding the filled cells
+        given to set_grid.
+
+        If a SearchStats stats is given, the search is counted and timed
+        in it. If a Tracer tracer is given, it is told of every step.
+
+        >>> stats = SearchStats()
+        >>> len(SudokuMatrix('0' * 80 + '9').solve(stats)), stats.nodes
+        (2, 100)
 
+        """
+        if stats is None and tracer is None:
+            return Search(self).run()
+
+        started = time.time()
+        search = Search(probe(self, stats, tracer))
+        if stats is None:
+            solutions = search.run()
+            tracer.flush()
             return solutions
 
-    def __solution_found(self, solutions):
-        """Print the matrix's state, tack off a solution, and backtrack."""
-        self.numSols -= 1
+        render = stats.render
+        solutions = search.run()
+        if tracer is not None:
+            tracer.flush()
+        stats.nodes += search.nodes
+        stats.lap('search', started)
 
-        solutions.append(self.get_string())
-        self.backtrack()
+        # Solutions are rendered as they are found.
+        stats.search -= stats.render - render
         return solutions
 
+    def count_solutions(self, limit=float('inf')):
+        """Return the number of solutions, counting no further than limit.
+
+        No solution is rendered as a string.
+
+        >>> SudokuMatrix('0' * 80 + '9').count_solutions(10)
+        10
+
+        """
+        search = self.counting_search(self, limit)
+        search.run()
+        return search.count
+
+    def counting_search(self, matrix=None, numSols=None, hint=None):
+        """Return a CountingSearch for the solutions of matrix.
+
+        matrix defaults to this matrix, and may be a probe wrapping it.
+
+        """
+        if matrix is None:
+            matrix = self
+        return CountingSearch(matrix, numSols, hint)
+
+    def is_unique(self):
+        """Return True if the puzzle has exactly one solution.
+
+        The search stops as soon as a second solution turns up.
+
+        """
+        return self.count_solutions(2) == 1
+
+    def iter_solutions(self, numSols=float('inf'), encoding='string'):
+        """Yield up to numSols solutions, each as soon as it is found.
+
+        Unlike solve, no list of solutions is kept, so enumerating every
+        solution of a sparse grid takes no more memory than the search
+        stack. Solutions are rendered by get_string, or by get_bytes if
+        encoding is 'bytes'. Closing the generator early abandons the
+        search, leaving the matrix holding only its filled cells.
+
+        >>> matrix = SudokuMatrix('0' * 80 + '9')
+        >>> solutions = matrix.iter_solutions()
+        >>> next(solutions) == matrix.solve()[0]
+        True
+        >>> len(matrix.choices) > 1
+        True
+        >>> solutions.close()
+        >>> len(matrix.choices)
+        1
+
+        """
+        search = SolutionStream(self, numSols, encoding)
+        try:
+            while not search.step():
+                yield search.solution
+        finally:
+            search.abandon()
+
+    def candidate_masks(self):
+        """Return the digits each empty cell may still take, as bitmasks.
+
+        Bit k of the mask of a cell is set if digit k + 1 is still
+        available there, that is, if its Candidate has not been removed
+        from the matrix by the cells filled so far. Filled cells have a
+        mask of 0. No search is made.
+
+        >>> masks = SudokuMatrix('12' + '0'*79).candidate_masks()
+        >>> masks[0], bin(masks[2]), bin(masks[9])
+        (0, '0b111111100', '0b111111100')
+
+        """
+        n = self.n
+        filled = set(choice[0] for choice in self.choices)
+        masks = [0] * n**2
+        for location in xrange(n**2):
+            if location not in filled:
+                mask = 0
+                for index in self.branches(self.cell_constraint(location)):
+                    mask |= 1 << index % n
+                masks[location] = mask
+        return masks
+
+    def forced_cells(self, masks=None):
+        """Return the empty cells whose digit is already forced.
+
+        A cell is forced if it has a single candidate left, or if it is
+        the only place left for some digit in its row, column, or box.
+        Returns a list of (row, col, digit), in the order of the cells.
+        masks, as returned by candidate_masks, is computed if not given.
+
+        >>> SudokuMatrix('12345678' + '0'*73).forced_cells()
+        [(0, 8, 9)]
+
+        """
+        if masks is None:
+            masks = self.candidate_masks()
+        n = self.n
+        units, cellUnits, peers = unit_tables(n, self.boxWidth)
+
+        forced = {}
+        for location, mask in enumerate(masks):
+            if mask and mask & (mask - 1) == 0:
+                forced[location] = mask
+        for unit in units:
+            once = twice = 0
+            for location in unit:
+                twice |= once & masks[location]
+                once |= masks[location]
+            hidden = once & ~twice
+            if hidden:
+                for location in unit:
+                    if masks[location] & hidden:
+                        forced.setdefault(location, masks[location] & hidden)
+
+        return [(location // n, location % n, mask.bit_length())
+                for location, mask in sorted(forced.iteritems())]
+
+    def is_solved(self):
+        """Return True if every Constraint has been covered."""
+        return self.root.right is self.root
+
+    def constraint_size(self, constraint):
+        """Return the number of nodes beneath constraint."""
+        return constraint.size
+
+    def branches(self, constraint):
+        """Return the numbers of the Candidates intersecting constraint.
+
+        Candidates are listed from the top of the Constraint down, which
+        is the order in which the search tries them.
+
+        """
+        n = self.n
+
+        branches = []
+        node = constraint.down
+        while node is not constraint:
+            candidate = node.candidate
+            branches.append(candidate.location * n + candidate.num)
+            node = node.down
+        return branches
+
     def backtrack(self):
         """Restore the matrix to its previous state."""
         lastChoice = self.choices.pop()[1]
@@ -510,7 +1051,7 @@ class Candidate(Node):
         self.left = self
 
         for x in self.intersections:
-            newNode = Node(self, x)
+            newNode = x.nodeClass(self, x)
 
             leftNode = self.left
 
@@ -584,6 +1125,8 @@ class Constraint:
     which no longer exist after inputting a number.
 
     """
+    # The class of the Nodes beneath the Constraint.
+    nodeClass = Node
 
     def __init__(self, sudokuMatrix):
         """Link self to the given sudokuMatrix."""
@@ -652,22 +1195,2557 @@ class Constraint:
                     leftNode = leftNode.left
                 upNode = upNode.up
 
+################################ Size Buckets #################################
+
+class BucketMatrix(SudokuMatrix):
+    """A SudokuMatrix which keeps its Constraints bucketed by size.
+
+    chosen_constraint scans every uncovered Constraint, which is 4 * n**2
+    headers at the top of the search. A BucketMatrix instead keeps one
+    list of uncovered Constraints per size, moving a Constraint between
+    lists whenever a Node beneath it is covered or uncovered. The
+    Constraint with the fewest Nodes is then the head of the first
+    non-empty list, found after looking at no more than n + 1 lists.
+
+    Among Constraints of equal size, the one which most recently changed
+    size is chosen, so solutions may be found in a different order than
+    SudokuMatrix finds them.
+
+    >>> grid = ('534008912672195348198342567'
+    ...         '859001423426853791713924856'
+    ...         '961537284287419635345286179')
+    >>> solutions = BucketMatrix(grid).solve()
+    >>> len(solutions), sorted(solutions) == sorted(SudokuMatrix(grid).solve())
+    (2, True)
+
+    A contradictory grid can be unwound like any other, and a pool answers
+    it with the grid:
+
+    >>> bad = '55' + '0' * 79
+    >>> matrix = BucketMatrix(bad)
+    >>> while matrix.choices != []:
+    ...     matrix.backtrack()
+    >>> pool = MatrixPool('buckets')
+    >>> find_solutions(bad, engine='buckets', pool=pool) == bad
+    True
+
+    """
+    def initialize_matrix(self):
+        """Initialize the Constraints, Candidates, and size buckets."""
+        self.buckets = [Bucket() for size in xrange(self.n + 1)]
+        SudokuMatrix.initialize_matrix(self)
+
+    def new_constraint(self):
+        """Create a BucketConstraint and link it into the matrix."""
+        return BucketConstraint(self)
+
+    def chosen_constraint(self):
+        """Return the Constraint with the fewest uncovered nodes."""
+        for bucket in self.buckets:
+            if bucket.next is not bucket:
+                return bucket.next
+
+class Bucket:
+    """The head of a circular list of Constraints of equal size."""
+    def __init__(self):
+        """Create an empty Bucket."""
+        self.next = self
+        self.prev = self
+
+class BucketNode(Node):
+    """A Node which moves its Constraint between size buckets."""
+
+    def cover_node(self):
+        """Remove the calling Node from the matrix."""
+        self.up.down = self.down
+        self.down.up = self.up
+
+        constraint = self.constraint
+        if constraint.covered:
+            constraint.size -= 1
+        else:
+            constraint.unbucket()
+            constraint.size -= 1
+            constraint.bucket()
+
+    def uncover_node(self):
+        """Invert the cover_node function."""
+        self.down.up = self
+        self.up.down = self
+
+        constraint = self.constraint
+        if constraint.covered:
+            constraint.size += 1
+        else:
+            constraint.unbucket()
+            constraint.size += 1
+            constraint.bucket()
+
+class BucketConstraint(Constraint):
+    """A Constraint which belongs to the size bucket of its matrix."""
+    nodeClass = BucketNode
+
+    def __init__(self, sudokuMatrix):
+        """Link self to the given sudokuMatrix and its size bucket."""
+        Constraint.__init__(self, sudokuMatrix)
+        self.buckets = sudokuMatrix.buckets
+        self.bucket()
+
+    def bucket(self):
+        """Add self to the front of the bucket for its size.
+
+        The Nodes of a contradictory grid can be covered twice, taking
+        the size outside the range of the buckets. Such a Constraint is
+        left out of every bucket until it is back in range.
+
+        """
+        if not 0 <= self.size < len(self.buckets):
+            self.next = self.prev = self
+            return
+        bucket = self.buckets[self.size]
+        self.next = bucket.next
+        self.prev = bucket
+        bucket.next.prev = self
+        bucket.next = self
+
+    def unbucket(self):
+        """Remove self from its bucket."""
+        self.prev.next = self.next
+        self.next.prev = self.prev
+
+    def cover(self):
+        """Unlink the Constraint from the SudokuMatrix and its bucket."""
+        if not self.covered:
+            self.unbucket()
+            Constraint.cover(self)
+
+    def uncover(self):
+        """Invert the cover(self) function."""
+        if self.covered:
+            Constraint.uncover(self)
+            self.bucket()
+
+################################ Array Engine #################################
+
+class ArrayMatrix(SudokuMatrix):
+    """A SudokuMatrix whose links are stored in flat integer arrays.
+
+    Rather than allocating a Python object for every Candidate, Node, and
+    Constraint, the ArrayMatrix numbers every node of the matrix and keeps
+    its links in parallel arrays indexed by that number:
+
+    0 is the root. 1 through 4 * n**2 are the Constraint headers, laid out
+    in the same order as the SudokuMatrix builds them. Every Candidate then
+    owns four consecutive nodes, one each under its cell, row, column, and
+    box Constraints.
+
+    The search visits Constraints and Candidates in exactly the same order
+    as SudokuMatrix.solve, so both engines return identical solutions.
+
+    >>> a = ArrayMatrix('0' * 80 + '9')
+    >>> b = SudokuMatrix('0' * 80 + '9', numSols=5)
+    >>> a.numSols = 5
+    >>> a.solve() == b.solve()
+    True
+    >>> a.choices
+    [(80, 728)]
+
+    """
+    # The arrays holding the matrix, as saved in a snapshot.
+    snapshotArrays = ('left', 'right', 'up', 'down', 'column', 'size',
+                      'covered')
+
+    def initialize_matrix(self):
+        """Initialize the link arrays, from a snapshot if one is in use.
+
+        See use_snapshots.
+
+        """
+        if _SNAPSHOT_DIR is None or not restore_snapshot(self,
+                                                         _SNAPSHOT_DIR):
+            self.build_links()
+
+        # A list of (location, Candidate number) pairs chosen so far.
+        self.choices = []
+        self.tainted = False
+
+    def build_links(self):
+        """Build the link arrays of an empty ArrayMatrix."""
+        n = self.n
+        numConstraints = 4 * n**2
+        numCandidates = n**3
+
+        # First node belonging to a Candidate.
+        self.firstNode = firstNode = numConstraints + 1
+        numNodes = firstNode + 4 * numCandidates
+
+        # The links are appended straight to the arrays, never to lists,
+        # so a 64 x 64 matrix of a million nodes takes no more than its
+        # arrays need.
+
+        # The header list threads the root and every Constraint.
+        left = array('i', xrange(-1, numConstraints))
+        left[0] = numConstraints
+        right = array('i', xrange(1, numConstraints + 2))
+        right[numConstraints] = 0
+
+        # Each Constraint header begins as an empty vertical list.
+        up = array('i', xrange(numConstraints + 1))
+        down = array('i', up)
+        column = array('i', up)
+
+        for row in xrange(n):
+            for col in xrange(n):
+                box = (col // self.boxWidth +
+                       self.boxHeight * (row // self.boxHeight))
+                cel = row * n + col
+
+                for num in xrange(n):
+                    intersections = (1 + 4 * cel,
+                                     2 + 4 * (row * n + num),
+                                     3 + 4 * (col * n + num),
+                                     4 + 4 * (box * n + num))
+
+                    node = len(up)
+                    for c in intersections:
+                        # Append the node to the bottom of its Constraint.
+                        up.append(up[c])
+                        down.append(c)
+                        down[up[c]] = node
+                        up[c] = node
+                        column.append(c)
+                        node += 1
+
+                    # Link the four nodes into a horizontal ring.
+                    node -= 4
+                    left.extend((node + 3, node, node + 1, node + 2))
+                    right.extend((node + 1, node + 2, node + 3, node))
+
+        assert(len(up) == numNodes)
+
+        self.left = left
+        self.right = right
+        self.up = up
+        self.down = down
+        self.column = column
+
+        # Every Constraint starts with n nodes beneath it.
+        self.size = array('i', [n] * (numConstraints + 1))
+        self.size[0] = numCandidates
+        self.covered = bytearray(numConstraints + 1)
+
+    def chosen_index(self, choice):
+        """Return the Candidate number of an entry of self.choices."""
+        return choice[1]
+
+    def cell_constraint(self, location):
+        """Return the Constraint that the cell at location be filled."""
+        return 1 + 4 * location
+
+    def constraint_number(self, c):
+        """Return the number of Constraint c, which is c itself."""
+        return c
+
+    def is_available(self, index):
+        """Return True if no chosen Candidate rules out Candidate index."""
+        node = self.firstNode + 4 * index
+        for c in self.column[node:node + 4]:
+            if self.covered[c]:
+                return False
+        return True
+
+    def choose(self, index):
+        """Add the Candidate numbered index to the partial solution."""
+        self.choices.append((index // self.n, index))
+
+        node = self.firstNode + 4 * index
+        for c in self.column[node:node + 4]:
+            self.cover(c)
+
+    def choose_counted(self, index):
+        """Choose Candidate index; return the Constraints covered and the
+        nodes unlinked, as SudokuMatrix.choose_counted does."""
+        self.choices.append((index // self.n, index))
+
+        covers = unlinks = 0
+        node = self.firstNode + 4 * index
+        for c in self.column[node:node + 4]:
+            if not self.covered[c]:
+                covers += 1
+                unlinks += 3 * self.size[c]
+                self.cover(c)
+        return covers, unlinks
+
+    def backtrack(self):
+        """Restore the matrix to its previous state."""
+        index = self.choices.pop()[1]
+
+        node = self.firstNode + 4 * index
+        for c in reversed(self.column[node:node + 4]):
+            self.uncover(c)
+
+    def cover(self, c):
+        """Unlink Constraint c and every Candidate intersecting it."""
+        if self.covered[c]:
+            return
+        self.covered[c] = 1
+
+        L = self.left
+        R = self.right
+        U = self.up
+        D = self.down
+        C = self.column
+        S = self.size
+
+        R[L[c]] = R[c]
+        L[R[c]] = L[c]
+
+        i = D[c]
+        while i != c:
+            j = R[i]
+            while j != i:
+                D[U[j]] = D[j]
+                U[D[j]] = U[j]
+                S[C[j]] -= 1
+                j = R[j]
+            i = D[i]
+
+    def uncover(self, c):
+        """Invert the cover function."""
+        if not self.covered[c]:
+            return
+        self.covered[c] = 0
+
+        L = self.left
+        R = self.right
+        U = self.up
+        D = self.down
+        C = self.column
+        S = self.size
+
+        R[L[c]] = c
+        L[R[c]] = c
+
+        i = U[c]
+        while i != c:
+            j = L[i]
+            while j != i:
+                D[U[j]] = j
+                U[D[j]] = j
+                S[C[j]] += 1
+                j = L[j]
+            i = U[i]
+
+    def is_solved(self):
+        """Return True if every Constraint has been covered."""
+        return self.right[0] == 0
+
+    def constraint_size(self, c):
+        """Return the number of nodes beneath Constraint c."""
+        return self.size[c]
+
+    def branches(self, c):
+        """Return the numbers of the Candidates intersecting Constraint c."""
+        D = self.down
+        firstNode = self.firstNode
+
+        branches = []
+        node = D[c]
+        while node != c:
+            branches.append((node - firstNode) // 4)
+            node = D[node]
+        return branches
+
+    def chosen_constraint(self):
+        """Return the Constraint with the fewest uncovered nodes."""
+        R = self.right
+        S = self.size
+
+        c = R[0]
+        selectedConstraint = c
+        size = S[c]
+
+        while c != 0:
+            if S[c] < size:
+                selectedConstraint = c
+                size = S[c]
+            c = R[c]
+
+        return selectedConstraint
+
+class ArrayBucketMatrix(ArrayMatrix):
+    """An ArrayMatrix which keeps its Constraints bucketed by size.
+
+    The buckets work as in BucketMatrix and are visited in the same
+    order, so both engines return identical solutions. Each bucket is a
+    circular list threaded through the bucketNext and bucketPrev arrays;
+    the head of the bucket for size s is node s of those arrays, and
+    Constraint c is node n + c.
+
+    >>> a = ArrayBucketMatrix('0' * 80 + '9', numSols=5)
+    >>> a.solve() == BucketMatrix('0' * 80 + '9', numSols=5).solve()
+    True
+
+    """
+    snapshotArrays = ArrayMatrix.snapshotArrays + ('bucketNext',
+                                                   'bucketPrev')
+
+    def build_links(self):
+        """Build the link arrays and the size buckets."""
+        ArrayMatrix.build_links(self)
+
+        n = self.n
+        numConstraints = 4 * n**2
+        self.bucketNext = array('i', range(n + 1) + [0] * numConstraints)
+        self.bucketPrev = array('i', self.bucketNext)
+
+        for c in xrange(1, numConstraints + 1):
+            self.bucket(c)
+
+    def bucket(self, c):
+        """Add Constraint c to the front of the bucket for its size."""
+        N = self.bucketNext
+        P = self.bucketPrev
+        node = self.n + c
+        head = self.size[c]
+
+        N[node] = N[head]
+        P[node] = head
+        P[N[head]] = node
+        N[head] = node
+
+    def unbucket(self, c):
+        """Remove Constraint c from its bucket."""
+        N = self.bucketNext
+        P = self.bucketPrev
+        node = self.n + c
+
+        N[P[node]] = N[node]
+        P[N[node]] = P[node]
+
+    def cover(self, c):
+        """Unlink Constraint c and every Candidate intersecting it."""
+        if self.covered[c]:
+            return
+        self.unbucket(c)
+        self.covered[c] = 1
+
+        L = self.left
+        R = self.right
+        U = self.up
+        D = self.down
+        C = self.column
+        S = self.size
+        covered = self.covered
+        N = self.bucketNext
+        P = self.bucketPrev
+        offset = self.n
+
+        R[L[c]] = R[c]
+        L[R[c]] = L[c]
+
+        i = D[c]
+        while i != c:
+            j = R[i]
+            while j != i:
+                D[U[j]] = D[j]
+                U[D[j]] = U[j]
+                k = C[j]
+                S[k] -= 1
+
+                # Move the Constraint down one bucket.
+                if not covered[k]:
+                    node = offset + k
+                    N[P[node]] = N[node]
+                    P[N[node]] = P[node]
+                    head = S[k]
+                    N[node] = N[head]
+                    P[node] = head
+                    P[N[head]] = node
+                    N[head] = node
+                j = R[j]
+            i = D[i]
+
+    def uncover(self, c):
+        """Invert the cover function."""
+        if not self.covered[c]:
+            return
+        self.covered[c] = 0
+
+        L = self.left
+        R = self.right
+        U = self.up
+        D = self.down
+        C = self.column
+        S = self.size
+        covered = self.covered
+        N = self.bucketNext
+        P = self.bucketPrev
+        offset = self.n
+
+        R[L[c]] = c
+        L[R[c]] = c
+
+        i = U[c]
+        while i != c:
+            j = L[i]
+            while j != i:
+                D[U[j]] = j
+                U[D[j]] = j
+                k = C[j]
+                S[k] += 1
+
+                # Move the Constraint up one bucket.
+                if not covered[k]:
+                    node = offset + k
+                    N[P[node]] = N[node]
+                    P[N[node]] = P[node]
+                    head = S[k]
+                    N[node] = N[head]
+                    P[node] = head
+                    P[N[head]] = node
+                    N[head] = node
+                j = L[j]
+            i = U[i]
+
+        self.bucket(c)
+
+    def chosen_constraint(self):
+        """Return the Constraint with the fewest uncovered nodes."""
+        N = self.bucketNext
+        for head in xrange(self.n + 1):
+            if N[head] != head:
+                return N[head] - self.n
+
+############################### Backjumping ###################################
+
+# Number of tied Constraints among which BackjumpMatrix picks at random.
+_TIES = 8
+
+# Dead ends met before the first restart of a BackjumpSearch; later
+# restarts follow the Luby sequence in multiples of it.
+_RESTART_FAILURES = 64
+
+# Nogoods kept by a BackjumpSearch, and the most choices one may hold.
+_NOGOODS = 10000
+_NOGOOD_SIZE = 12
+
+# Maps (n, boxWidth) to the Candidates of every Constraint.
+_CONSTRAINT_ROWS = {}
+
+class BackjumpMatrix(ArrayBucketMatrix):
+    """An ArrayBucketMatrix searched by conflict-directed backjumping.
+
+    Its solutions are counted by a BackjumpSearch rather than by the
+    chronological CountingSearch, and it breaks ties between the smallest
+    Constraints at random, so that the restarts of a BackjumpSearch do not
+    repeat themselves. Counts, and so uniqueness, are exact; which of
+    several solutions is found first is not fixed.
+
+    >>> BackjumpMatrix('0' * 80 + '9').count_solutions(5)
+    5
+    >>> analyze(_EMPTY_GRID, engine='backjump').status
+    'multiple'
+
+    """
+    def initialize_matrix(self):
+        """Initialize the link arrays and the tie-breaking generator."""
+        ArrayBucketMatrix.initialize_matrix(self)
+        self.random = random.Random(0)
+
+    def chosen_constraint(self):
+        """Return one of the Constraints with the fewest uncovered nodes.
+
+        The choice is random among the first few in their bucket.
+
+        """
+        N = self.bucketNext
+        n = self.n
+        for head in xrange(n + 1):
+            node = N[head]
+            if node != head:
+                ties = []
+                while node != head and len(ties) < _TIES:
+                    ties.append(node - n)
+                    node = N[node]
+                return ties[self.random.randrange(len(ties))]
+
+    def counting_search(self, matrix=None, numSols=None, hint=None):
+        """Return a BackjumpSearch counting the solutions of matrix."""
+        if matrix is None:
+            matrix = self
+        return BackjumpSearch(matrix, numSols, hint, self)
+
+class BackjumpSearch:
+    """A count of solutions by conflict-directed backjumping.
+
+    When a Constraint is left without Candidates, the search works out
+    which of its choices removed them: a Candidate is removed by the
+    earliest choice sharing a Constraint with it. Rather than backtracking
+    one level, it jumps back to the latest of those choices, since trying
+    other branches at the levels in between could not bring a Candidate
+    back. A level whose every branch failed passes the union of their
+    reasons up in the same way, and remembers the choices named in it as
+    a nogood, which no later branch may complete.
+
+    Until the first solution is found, the search restarts from the root
+    after a growing number of dead ends, keeping its nogoods; a nogood
+    rules out only branches without a solution, so counts stay exact.
+    Once a solution has been found below a level, the levels above it
+    are backtracked chronologically.
+
+    The interface is that of CountingSearch, except that the search runs
+    in a single call to run.
+
+    >>> search = BackjumpSearch(BackjumpMatrix('0' * 80 + '9'), numSols=3)
+    >>> search.run(), search.count, len(search.first)
+    ([], 3, 81)
+
+    """
+    def __init__(self, matrix, numSols=None, hint=None, engine=None):
+        """Prepare to count up to numSols solutions of matrix.
+
+        engine is the BackjumpMatrix which matrix, a probe, may wrap.
+
+        """
+        self.matrix = matrix
+        if engine is None:
+            engine = matrix
+        self.engine = engine
+        if numSols is None:
+            numSols = matrix.numSols
+        self.numSols = numSols
+        self.solutions = []
+
+        self.hinted = None
+        if hint is not None:
+            self.hinted = hint_candidates(hint, engine.n)
+
+        self.count = 0
+        self.first = None
+        self.nodes = 0
+        self.finished = False
+        self.exhausted = False
+
+        # Levels jumped over, restarts made, and nogoods learned.
+        self.backjumps = 0
+        self.restarts = 0
+        self.learned = 0
+
+        # Learned nogoods, oldest first, and those holding each Candidate.
+        self.nogoods = OrderedDict()
+        self.watches = {}
+
+    def run(self, maxNodes=None, deadline=None, cancel=None):
+        """Count the solutions, giving up as Search.run does."""
+        matrix = self.matrix
+        engine = self.engine
+        column = engine.column
+        firstNode = engine.firstNode
+        rowsOf = constraint_rows(engine.n, engine.boxWidth)
+        if maxNodes is not None:
+            maxNodes += self.nodes
+
+        # The level of the choice covering each Constraint, or -1; the
+        # given cells are at level 0.
+        coverLevel = array('i', [-1]) * len(column)
+        for choice in engine.choices:
+            node = firstNode + 4 * engine.chosen_index(choice)
+            for c in column[node:node + 4]:
+                if coverLevel[c] < 0:
+                    coverLevel[c] = 0
+
+        # One [constraint, branches, tried, reasons, solved] frame per
+        # level, and the Candidate chosen at each level.
+        stack = []
+        rows = []
+        levels = {}
+
+        def removal(x):
+            """Return the level of the earliest choice ruling out x."""
+            node = firstNode + 4 * x
+            return min([coverLevel[c] for c in column[node:node + 4]
+                        if coverLevel[c] >= 0])
+
+        def choose(x):
+            """Choose Candidate x at the next level."""
+            matrix.choose(x)
+            rows.append(x)
+            level = levels[x] = len(rows)
+            node = firstNode + 4 * x
+            for c in column[node:node + 4]:
+                coverLevel[c] = level
+
+        def unchoose():
+            """Undo the choice at the deepest level."""
+            matrix.backtrack()
+            x = rows.pop()
+            del levels[x]
+            node = firstNode + 4 * x
+            for c in column[node:node + 4]:
+                coverLevel[c] = -1
+
+        def unwind():
+            """Undo every choice made by the search."""
+            while rows:
+                unchoose()
+            del stack[:]
+
+        failures = 0
+        restartAt = _RESTART_FAILURES
+        reasons = None
+        while True:
+            if reasons is None:
+                # Visit the state of the matrix.
+                if self.nodes == maxNodes or (
+                        self.nodes % _DEADLINE_NODES == 0 and
+                        ((deadline is not None and time.time() >= deadline)
+                         or (cancel is not None and cancel.is_set()))):
+                    unwind()
+                    self.exhausted = True
+                    return self.solutions
+                self.nodes += 1
+
+                if matrix.is_solved():
+                    self.count += 1
+                    if self.first is None:
+                        self.first = list(engine.choices)
+                    if self.count >= self.numSols:
+                        unwind()
+                        break
+                    for frame in stack:
+                        frame[4] = True
+                    reasons = set(xrange(1, len(stack) + 1))
+                else:
+                    constraint = matrix.chosen_constraint()
+                    if matrix.constraint_size(constraint) == 0:
+                        reasons = set([removal(x) for x in
+                                       rowsOf[constraint]])
+                        reasons.discard(0)
+                        failures += 1
+                    else:
+                        branches = matrix.branches(constraint)
+                        if self.hinted is not None:
+                            for i, index in enumerate(branches):
+                                if index in self.hinted:
+                                    if i:
+                                        branches.insert(0, branches.pop(i))
+                                    break
+                        stack.append([constraint, branches, 0, set(),
+                                      False])
+                        reasons = set([len(stack)])
+
+            # Jump back to the latest level among the reasons, and try its
+            # next branch.
+            while stack:
+                level = len(stack)
+                frame = stack[-1]
+                constraint, branches, tried, why, solved = frame
+                if tried:
+                    unchoose()
+                if level not in reasons:
+                    stack.pop()
+                    self.backjumps += 1
+                    continue
+
+                why.update(reasons)
+                why.discard(level)
+                reasons = None
+                while tried < len(branches):
+                    x = branches[tried]
+                    tried += 1
+                    conflict = self.violated(x, levels)
+                    if conflict is None:
+                        choose(x)
+                        break
+                    why.update(conflict)
+                else:
+                    # Every branch failed.
+                    frame[2] = tried
+                    if solved:
+                        reasons = set(xrange(1, level))
+                    else:
+                        reasons = why
+                        branched = set(branches)
+                        for x in rowsOf[constraint]:
+                            if x not in branched:
+                                reasons.add(removal(x))
+                        reasons.discard(0)
+                        reasons.discard(level)
+                        self.learn([rows[l - 1] for l in reasons])
+                    stack.pop()
+                    continue
+                frame[2] = tried
+                break
+
+            if not stack and reasons is not None:
+                break
+
+            if self.count == 0 and failures >= restartAt:
+                unwind()
+                self.restarts += 1
+                failures = 0
+                restartAt = _RESTART_FAILURES * luby(self.restarts + 1)
+
+        self.finished = True
+        return self.solutions
+
+    def violated(self, x, levels):
+        """Return the levels of a nogood choosing x would complete."""
+        for nogood in self.watches.get(x, ()):
+            conflict = []
+            for y in nogood:
+                if y != x:
+                    level = levels.get(y)
+                    if level is None:
+                        break
+                    conflict.append(level)
+            else:
+                return conflict
+        return None
+
+    def learn(self, choices):
+        """Remember that choices together leave no solution."""
+        if not choices or len(choices) > _NOGOOD_SIZE:
+            return
+        nogood = frozenset(choices)
+        if nogood in self.nogoods:
+            return
+        self.nogoods[nogood] = True
+        self.learned += 1
+        for x in nogood:
+            self.watches.setdefault(x, []).append(nogood)
+
+        if len(self.nogoods) > _NOGOODS:
+            oldest, flag = self.nogoods.popitem(last=False)
+            for x in oldest:
+                self.watches[x].remove(oldest)
+
+def constraint_rows(n, boxWidth):
+    """Return the Candidates of every Constraint of an n x n grid.
+
+    Constraints are numbered as by ArrayMatrix; entry 0 is unused.
+
+    >>> constraint_rows(4, 2)[1]
+    (0, 1, 2, 3)
+
+    """
+    key = (n, boxWidth)
+    if key in _CONSTRAINT_ROWS:
+        return _CONSTRAINT_ROWS[key]
+
+    boxHeight = n // boxWidth
+    rows = [[] for i in xrange(4 * n**2 + 1)]
+    for row in xrange(n):
+        for col in xrange(n):
+            box = col // boxWidth + boxHeight * (row // boxHeight)
+            cel = row * n + col
+            for num in xrange(n):
+                index = cel * n + num
+                rows[1 + 4 * cel].append(index)
+                rows[2 + 4 * (row * n + num)].append(index)
+                rows[3 + 4 * (col * n + num)].append(index)
+                rows[4 + 4 * (box * n + num)].append(index)
+
+    table = [tuple(r) for r in rows]
+    _CONSTRAINT_ROWS[key] = table
+    return table
+
+def luby(i):
+    """Return the ith term of the Luby sequence 1, 1, 2, 1, 1, 2, 4, ...
+
+    >>> [luby(i) for i in xrange(1, 8)]
+    [1, 1, 2, 1, 1, 2, 4]
+
+    """
+    while True:
+        k = 1
+        while (1 << k) - 1 < i:
+            k += 1
+        if i == (1 << k) - 1:
+            return 1 << (k - 1)
+        i -= (1 << (k - 1)) - 1
+
+# The exact cover engines selectable from find_solutions.
+ENGINES = {'links': SudokuMatrix,
+           'array': ArrayMatrix,
+           'buckets': BucketMatrix,
+           'array-buckets': ArrayBucketMatrix,
+           'backjump': BackjumpMatrix}
+
+#################################### Search ###################################
+
+# Number of search nodes visited per slice by Search.slices.
+_SLICE_NODES = 1000
+
+# Number of search nodes visited between checks of a deadline.
+_DEADLINE_NODES = 256
+
+class Search:
+    """A depth-first search for solutions which can be paused and resumed.
+
+    Rather than recursing once per chosen Candidate, a Search keeps an
+    explicit stack holding, for every depth, the Candidates intersecting
+    the Constraint chosen there and how many of them have been tried. The
+    search can therefore run for a bounded number of nodes, return, and
+    later pick up where it stopped, and it is not limited by Python's
+    recursion limit.
+
+    Candidates are tried in the same order as the recursive algorithm, so
+    solutions are found in the same order. The matrix must not be changed
+    by anyone else while the Search is unfinished.
+
+    >>> search = Search(SudokuMatrix('0' * 80 + '9'), numSols=3)
+    >>> search.step(30)
+    False
+    >>> search.nodes, len(search.solutions)
+    (30, 0)
+    >>> search.run() == SudokuMatrix('0' * 80 + '9', numSols=3).solve()
+    True
+    >>> [nodes for nodes in Search(ArrayMatrix(), numSols=1).slices(50)]
+    [50]
+
+    Given a hint grid, the Candidates agreeing with it are tried first.
+    A hint which is a solution is found without backtracking:
+
+    >>> solution = SudokuMatrix('0' * 80 + '9', numSols=1).solve()[0]
+    >>> search = Search(SudokuMatrix('0' * 80 + '9'), 1, hint=solution)
+    >>> search.run() == [solution], search.nodes
+    (True, 81)
+
+    """
+    def __init__(self, matrix, numSols=None, hint=None):
+        """Prepare to search matrix for numSols solutions.
+
+        numSols defaults to the matrix's own numSols. hint is an optional
+        grid whose Candidates are tried first.
+
+        """
+        self.matrix = matrix
+        if numSols is None:
+            numSols = matrix.numSols
+        self.numSols = numSols
+        self.solutions = []
+
+        # The Candidate numbers of the hint's filled cells.
+        self.hinted = None
+        if hint is not None:
+            self.hinted = hint_candidates(hint, matrix.n)
+
+        # One [branches, tried] frame per depth. The last Candidate tried
+        # in each frame is the one currently chosen.
+        self.stack = []
+
+        # The number of search nodes visited so far.
+        self.nodes = 0
+
+        # True when the state of the matrix has yet to be visited.
+        self.pending = True
+        self.finished = False
+
+        # True if the search was stopped before it could finish.
+        self.exhausted = False
+
+    def step(self, maxNodes=None):
+        """Visit up to maxNodes more search nodes.
+
+        Returns True once the search is finished, at which point the
+        matrix is back in the state the Search found it in. Returns False
+        early if solution_found returns True.
+
+        """
+        matrix = self.matrix
+        stack = self.stack
+        if maxNodes is not None:
+            maxNodes += self.nodes
+
+        while not self.finished:
+            if self.pending:
+                if self.nodes == maxNodes:
+                    return False
+                self.pending = False
+                self.nodes += 1
+
+                if self.numSols <= 0:
+                    pass
+
+                # Success: matrix is empty.
+                elif matrix.is_solved():
+                    # solution_found may ask for the search to pause.
+                    if self.solution_found():
+                        return False
+
+                else:
+                    constraint = matrix.chosen_constraint()
+
+                    # A Constraint with no Nodes is a logical contradiction.
+                    if matrix.constraint_size(constraint) > 0:
+                        branches = matrix.branches(constraint)
+                        if self.hinted is not None:
+                            # Move the first hinted Candidate to the front.
+                            for i, index in enumerate(branches):
+                                if index in self.hinted:
+                                    if i:
+                                        branches.insert(0, branches.pop(i))
+                                    break
+                        stack.append([branches, 0])
+
+            # Undo the last choice and make the next one.
+            while stack:
+                frame = stack[-1]
+                branches, tried = frame
+                if tried:
+                    matrix.backtrack()
+                if tried < len(branches) and self.numSols > 0:
+                    matrix.choose(branches[tried])
+                    frame[1] = tried + 1
+                    self.pending = True
+                    break
+                stack.pop()
+
+            if not self.pending:
+                self.finished = True
+        return True
+
+    def run(self, maxNodes=None, deadline=None, cancel=None):
+        """Search to the end and return the solutions found.
+
+        If more than maxNodes search nodes would be visited, or the time
+        passes deadline, the search is abandoned and exhausted is set.
+        cancel may be a threading.Event, or anything else with an is_set
+        method; it is checked as often as the deadline, and the search is
+        abandoned likewise once it is set.
+
+        >>> cancel = threading.Event()
+        >>> cancel.set()
+        >>> search = Search(SudokuMatrix(), numSols=1)
+        >>> search.run(cancel=cancel), search.exhausted
+        ([], True)
+
+        """
+        if deadline is None and cancel is None:
+            self.step(maxNodes)
+        else:
+            if maxNodes is not None:
+                maxNodes += self.nodes
+            while not self.finished:
+                if deadline is not None and time.time() >= deadline:
+                    break
+                if cancel is not None and cancel.is_set():
+                    break
+                nodes = _DEADLINE_NODES
+                if maxNodes is not None:
+                    nodes = min(nodes, maxNodes - self.nodes)
+                    if nodes <= 0:
+                        break
+                self.step(nodes)
+
+        if not self.finished:
+            self.abandon()
+            self.exhausted = True
+        return self.solutions
+
+    def slices(self, nodes=_SLICE_NODES):
+        """Search nodes at a time, yielding the running node count.
+
+        Each iteration does a bounded amount of work, so a scheduler can
+        interleave many searches by advancing each generator in turn.
+
+        """
+        while not self.step(nodes):
+            yield self.nodes
+
+    def abandon(self):
+        """Stop the search, restoring the matrix to its original state."""
+        while self.stack:
+            if self.stack[-1][1]:
+                self.matrix.backtrack()
+            self.stack.pop()
+        self.pending = False
+        self.finished = True
+
+    def solution_found(self):
+        """Record the solution held by the matrix."""
+        self.numSols -= 1
+        self.solutions.append(self.matrix.get_string())
+
+class SolutionStream(Search):
+    """A Search which pauses at every solution instead of keeping it.
+
+    After each call to step which returns False, solution holds the
+    solution just found, rendered by get_string or, with the encoding
+    'bytes', by get_bytes.
+
+    """
+    def __init__(self, matrix, numSols=None, encoding='string'):
+        """Prepare to stream up to numSols solutions of matrix."""
+        Search.__init__(self, matrix, numSols)
+        if encoding == 'string':
+            self.render = matrix.get_string
+        elif encoding == 'bytes':
+            self.render = matrix.get_bytes
+        else:
+            raise ValueError('unknown encoding %r' % encoding)
+        self.solution = None
+
+    def solution_found(self):
+        """Render the solution held by the matrix and pause."""
+        self.numSols -= 1
+        self.solution = self.render()
+        return True
+
+class CountingSearch(Search):
+    """A Search which counts solutions without rendering them.
+
+    Only the choices making up the first solution are kept, in first, so
+    that it can be rendered with get_string once it is known to be the
+    only one.
+
+    >>> search = CountingSearch(SudokuMatrix('0' * 80 + '9'), numSols=5)
+    >>> search.run(), search.count, len(search.first)
+    ([], 5, 81)
+
+    """
+    def __init__(self, matrix, numSols=None, hint=None):
+        """Prepare to count up to numSols solutions of matrix."""
+        Search.__init__(self, matrix, numSols, hint)
+        self.count = 0
+        self.first = None
+
+    def solution_found(self):
+        """Count the solution held by the matrix."""
+        self.numSols -= 1
+        self.count += 1
+        if self.first is None:
+            self.first = list(self.matrix.choices)
+
+class SearchStats:
+    """Counters and timings describing a search, collected on request.
+
+    Counting happens in a SearchProbe standing in for the matrix, so a
+    search which was not asked for a SearchStats runs exactly as before.
+
+    nodes: the number of search nodes visited.
+    covers: the number of Constraints covered.
+    unlinks: the number of Nodes unlinked while covering them.
+    backtracks: the number of choices undone.
+    maxDepth: the largest number of choices made by the search at once.
+    branching: maps each size of the Constraints chosen to branch on to
+    how often it was chosen; size 0 is a dead end.
+
+    setup, setGrid, propagate, search, render: the seconds spent building
+    the matrix, filling in the givens, propagating singles, searching,
+    and rendering solutions.
+
+    """
+    def __init__(self):
+        """Create a SearchStats with every counter at zero."""
+        self.nodes = 0
+        self.covers = 0
+        self.unlinks = 0
+        self.backtracks = 0
+        self.maxDepth = 0
+        self.branching = {}
+
+        self.setup = 0.0
+        self.setGrid = 0.0
+        self.propagate = 0.0
+        self.search = 0.0
+        self.render = 0.0
+
+    def __repr__(self):
+        """String representation of the SearchStats."""
+        return ("<SearchStats %d nodes, %d covers, %d backtracks>" %
+                (self.nodes, self.covers, self.backtracks))
+
+    def lap(self, phase, since):
+        """Add the seconds from since until now to phase; return now."""
+        now = time.time()
+        setattr(self, phase, getattr(self, phase) + now - since)
+        return now
+
+    def as_dict(self):
+        """Return the counters and timings as a dict, e.g. for JSON."""
+        return dict((name, getattr(self, name)) for name in
+                    ('nodes', 'covers', 'unlinks', 'backtracks',
+                     'maxDepth', 'branching', 'setup', 'setGrid',
+                     'propagate', 'search', 'render'))
+
+class SearchProbe:
+    """Stands in for a matrix in a Search, counting into a SearchStats.
+
+    >>> stats = SearchStats()
+    >>> search = CountingSearch(SearchProbe(ArrayMatrix('0' * 80 + '9'),
+    ...                                     stats), numSols=2)
+    >>> search.run(), stats.maxDepth, stats.covers, stats.branching[1]
+    ([], 80, 396, 54)
+
+    """
+    def __init__(self, matrix, stats):
+        """Wrap matrix, counting into stats."""
+        self.matrix = matrix
+        self.stats = stats
+        self.n = matrix.n
+        self.numSols = matrix.numSols
+        self.choices = matrix.choices
+        self.depth = 0
+
+    def is_solved(self):
+        """Return True if the matrix is solved."""
+        return self.matrix.is_solved()
+
+    def chosen_constraint(self):
+        """Return the matrix's Constraint to branch on, counting its size."""
+        constraint = self.matrix.chosen_constraint()
+        size = self.matrix.constraint_size(constraint)
+        branching = self.stats.branching
+        branching[size] = branching.get(size, 0) + 1
+        return constraint
+
+    def constraint_size(self, constraint):
+        """Return the number of Nodes beneath constraint."""
+        return self.matrix.constraint_size(constraint)
+
+    def constraint_number(self, constraint):
+        """Return the number of constraint."""
+        return self.matrix.constraint_number(constraint)
+
+    def branches(self, constraint):
+        """Return the Candidates intersecting constraint."""
+        return self.matrix.branches(constraint)
+
+    def choose(self, index):
+        """Choose Candidate index, counting covers and unlinks."""
+        covers, unlinks = self.matrix.choose_counted(index)
+        self.stats.covers += covers
+        self.stats.unlinks += unlinks
+        self.depth += 1
+        if self.depth > self.stats.maxDepth:
+            self.stats.maxDepth = self.depth
+
+    def backtrack(self):
+        """Undo the last choice."""
+        self.matrix.backtrack()
+        self.stats.backtracks += 1
+        self.depth -= 1
+
+    def get_string(self, choices=None):
+        """Render the matrix's partial solution, timing it."""
+        started = time.time()
+        s = self.matrix.get_string(choices)
+        self.stats.lap('render', started)
+        return s
+
+def probe(matrix, stats=None, tracer=None):
+    """Return matrix, wrapped to count into stats and to trace to tracer.
+
+    Without either, matrix itself is returned and nothing is slowed down.
+
+    """
+    if stats is not None:
+        matrix = SearchProbe(matrix, stats)
+    if tracer is not None:
+        matrix = TraceProbe(matrix, tracer)
+    return matrix
+
+# The possible statuses of a SolveResult.
+UNIQUE = 'unique'
+MULTIPLE = 'multiple'
+NONE = 'none'
+UNKNOWN = 'unknown'
+
+class SolveResult:
+    """The outcome of searching a grid, as returned by analyze.
+
+    status is UNIQUE, MULTIPLE, or NONE when the search settled the
+    question, and UNKNOWN when it was stopped by its node or time budget
+    or by numSols before it could. The partial statistics remain valid
+    either way:
+
+    count: the number of solutions found.
+    solution: the solution, if exactly one was found.
+    nodes: the number of search nodes visited.
+    settled: the number of cells filled in by propagation.
+    elapsed: the wall-clock seconds spent.
+    exhausted: True if the node or time budget ran out.
+    cached: True if the answer came from a SolutionCache.
+    stats: the SearchStats of the search, if analyze was asked for one.
+
+    """
+    def __init__(self, numSols=_NUMSOLS):
+        """Create an empty SolveResult for a search for numSols solutions."""
+        self.numSols = numSols
+        self.status = UNKNOWN
+        self.count = 0
+        self.solution = None
+        self.nodes = 0
+        self.settled = 0
+        self.elapsed = 0.0
+        self.exhausted = False
+        self.cached = False
+        self.stats = None
+
+    def __repr__(self):
+        """String representation of the SolveResult."""
+        return ("<SolveResult %s: %d solutions, %d nodes, %.3fs>" %
+                (self.status, self.count, self.nodes, self.elapsed))
+
+    def finish(self, count, solution, exhausted, started):
+        """Record the outcome of a search begun at time started."""
+        self.count = count
+        self.solution = solution
+        self.exhausted = exhausted
+        self.elapsed = time.time() - started
+
+        if count > 1:
+            self.status = MULTIPLE
+        elif exhausted or count >= self.numSols:
+            # Stopped before the rest of the tree was searched.
+            self.status = UNKNOWN
+        elif count:
+            self.status = UNIQUE
+        else:
+            self.status = NONE
+        return self
+
+################################### Tracing ###################################
+
+class Tracer:
+    """Receives the events of a search from a TraceProbe.
+
+    Each event is a dict holding its kind as 'event', the number of
+    choices made by the search as 'depth', and the seconds since the
+    Tracer was created as 't'. The kinds of events are:
+
+    select: a Constraint was chosen to branch on; 'constraint' names it
+    and 'size' is the number of Candidates intersecting it.
+    dead-end: the Constraint chosen has no Candidates left.
+    choose, unchoose: a Candidate was chosen or its choice undone;
+    'candidate' is its number, and 'row', 'col', and 'digit' its meaning.
+    solution: every Constraint is covered.
+
+    Only every sample'th event is passed on to emit, and, with maxDepth,
+    only events no deeper than maxDepth; the latter keeps every choose
+    paired with its unchoose. Subclasses override emit.
+
+    """
+    def __init__(self, sample=1, maxDepth=None):
+        """Create a Tracer passing on every sample'th event."""
+        self.sample = sample
+        self.maxDepth = maxDepth
+        self.seen = 0
+        self.started = time.time()
+
+    def event(self, kind, depth, **fields):
+        """Pass the event on to emit if it is sampled."""
+        if self.maxDepth is not None and depth > self.maxDepth:
+            return
+        self.seen += 1
+        if (self.seen - 1) % self.sample:
+            return
+        fields['event'] = kind
+        fields['depth'] = depth
+        fields['t'] = time.time() - self.started
+        self.emit(fields)
+
+    def emit(self, event):
+        """Record the event; Tracer itself discards it."""
+        pass
+
+    def flush(self):
+        """Write out any buffered events."""
+        pass
+
+class JSONLTracer(Tracer):
+    """A Tracer writing each event as a line of JSON to a file.
+
+    Lines are buffered, and written whenever bufferSize of them are
+    waiting and when the search ends.
+
+    >>> import StringIO
+    >>> f = StringIO.StringIO()
+    >>> len(SudokuMatrix('0' * 80 + '9').solve(tracer=JSONLTracer(f)))
+    2
+    >>> json.loads(f.getvalue().split('\\n')[1])['event']
+    u'choose'
+
+    """
+    def __init__(self, f, sample=1, maxDepth=None, bufferSize=1000):
+        """Create a JSONLTracer writing to the file f."""
+        Tracer.__init__(self, sample, maxDepth)
+        self.f = f
+        self.bufferSize = bufferSize
+        self.buffer = []
+
+    def emit(self, event):
+        """Buffer the event as a line of JSON."""
+        self.buffer.append(json.dumps(event, sort_keys=True))
+        if len(self.buffer) >= self.bufferSize:
+            self.flush()
+
+    def flush(self):
+        """Write the buffered lines to the file."""
+        if self.buffer:
+            self.f.write('\n'.join(self.buffer) + '\n')
+            self.buffer = []
+        self.f.flush()
+
+class ChromeTracer(Tracer):
+    """A Tracer keeping events for the Chrome trace viewer.
+
+    Each choice becomes a span from its choose to its unchoose, and the
+    other events instants, so that chrome://tracing draws the search
+    tree. Only the first maxEvents events are kept; the number dropped
+    is counted in dropped. write saves the trace as JSON.
+
+    >>> tracer = ChromeTracer(maxEvents=5)
+    >>> SudokuMatrix('0' * 80 + '9', numSols=1).solve(tracer=tracer) != []
+    True
+    >>> len(tracer.events), tracer.dropped > 0
+    (5, True)
+
+    """
+    def __init__(self, sample=1, maxDepth=None, maxEvents=100000):
+        """Create a ChromeTracer keeping up to maxEvents events."""
+        Tracer.__init__(self, sample, maxDepth)
+        self.maxEvents = maxEvents
+        self.events = []
+        self.dropped = 0
+
+    def emit(self, event):
+        """Convert the event to a Chrome trace event and keep it."""
+        if len(self.events) >= self.maxEvents:
+            self.dropped += 1
+            return
+
+        kind = event.pop('event')
+        if kind in ('choose', 'unchoose'):
+            name = 'r%dc%d=%d' % (event['row'] + 1, event['col'] + 1,
+                                  event['digit'])
+            phase = kind == 'choose' and 'B' or 'E'
+        else:
+            name = kind
+            phase = 'i'
+
+        self.events.append({'name': name, 'ph': phase, 'pid': 1, 'tid': 1,
+                            'ts': int(1000000 * event.pop('t')),
+                            'args': event})
+
+    def write(self, f):
+        """Write the trace to the file f as JSON."""
+        json.dump({'traceEvents': self.events,
+                   'displayTimeUnit': 'ms',
+                   'otherData': {'dropped': self.dropped}}, f)
+
+class TraceProbe:
+    """Stands in for a matrix in a Search, telling a Tracer of each step.
+
+    The matrix may itself be a SearchProbe.
+
+    """
+    def __init__(self, matrix, tracer):
+        """Wrap matrix, tracing to tracer."""
+        self.matrix = matrix
+        self.tracer = tracer
+        self.n = matrix.n
+        self.numSols = matrix.numSols
+        self.choices = matrix.choices
+
+        # The Candidates chosen through the probe, in order.
+        self.path = []
+
+    def is_solved(self):
+        """Return True if the matrix is solved, tracing a solution."""
+        if self.matrix.is_solved():
+            self.tracer.event('solution', len(self.path))
+            return True
+        return False
+
+    def chosen_constraint(self):
+        """Return the matrix's Constraint to branch on, tracing it."""
+        constraint = self.matrix.chosen_constraint()
+        size = self.matrix.constraint_size(constraint)
+        depth = len(self.path)
+
+        number = self.matrix.constraint_number(constraint)
+        self.tracer.event('select', depth, size=size,
+                          constraint=constraint_name(number, self.n))
+        if size == 0:
+            self.tracer.event('dead-end', depth)
+        return constraint
+
+    def constraint_size(self, constraint):
+        """Return the number of Nodes beneath constraint."""
+        return self.matrix.constraint_size(constraint)
+
+    def constraint_number(self, constraint):
+        """Return the number of constraint."""
+        return self.matrix.constraint_number(constraint)
+
+    def branches(self, constraint):
+        """Return the Candidates intersecting constraint."""
+        return self.matrix.branches(constraint)
+
+    def choose(self, index):
+        """Choose Candidate index, tracing it."""
+        self.matrix.choose(index)
+        self.path.append(index)
+        self.trace('choose', index)
+
+    def backtrack(self):
+        """Undo the last choice, tracing it."""
+        index = self.path.pop()
+        self.trace('unchoose', index)
+        self.matrix.backtrack()
+
+    def trace(self, kind, index):
+        """Tell the tracer of a choice of Candidate index."""
+        n = self.n
+        self.tracer.event(kind, len(self.path), candidate=index,
+                          row=index // n**2, col=index // n % n,
+                          digit=index % n + 1)
+
+    def get_string(self, choices=None):
+        """Render the matrix's partial solution."""
+        return self.matrix.get_string(choices)
+
+def constraint_name(number, n):
+    """Describe the Constraint numbered number in an n x n grid.
+
+    >>> constraint_name(1, 9), constraint_name(4 + 4 * 13, 9)
+    ('cell r1c1', 'box 2 digit 5')
+
+    """
+    k, kind = divmod(number - 1, 4)
+    place, num = divmod(k, n)
+    if kind == 0:
+        return 'cell r%dc%d' % (place + 1, num + 1)
+    return '%s %d digit %d' % (('row', 'column', 'box')[kind - 1],
+                               place + 1, num + 1)
+
+################################# Matrix Pool #################################
+
+class MatrixPool:
+    """A thread-safe pool of pristine matrices keyed by (n, boxWidth).
+
+    Building the exact cover matrix costs more than solving most 9 x 9
+    puzzles, and the empty matrix for a given (n, boxWidth) never
+    changes. A MatrixPool hands out matrices which have already been
+    built and, when they are returned, resets them by unwinding their
+    choices.
+
+    At most maxIdle matrices are kept for each size and at most maxSizes
+    sizes are kept at all; the least recently used size is evicted first.
+
+    >>> pool = MatrixPool(maxSizes=1)
+    >>> find_solutions(_EMPTY_GRID, pool=pool) == '0'*81
+    True
+    >>> pool.idle.keys()
+    [(9, 3)]
+    >>> pool.checkin(pool.checkout(4, 2))
+    >>> pool.idle.keys()
+    [(4, 2)]
+
+    """
+    def __init__(self, engine=_ENGINE, maxIdle=4, maxSizes=8):
+        """Create an empty MatrixPool.
+
+        Keyword Arguments:
+
+        engine: the name of the engine in ENGINES to build matrices with.
+        maxIdle: the number of idle matrices to keep for each size.
+        maxSizes: the number of different sizes to keep matrices for.
+
+        """
+        self.engine = ENGINES[engine]
+        self.maxIdle = maxIdle
+        self.maxSizes = maxSizes
+
+        # Maps (n, boxWidth) to a list of idle matrices, least recently
+        # used size first.
+        self.idle = OrderedDict()
+        self.lock = threading.Lock()
+
+    def checkout(self, n, boxWidth):
+        """Return an empty matrix for an n x n grid, building it if needed."""
+        key = (n, boxWidth)
+        with self.lock:
+            matrices = self.idle.pop(key, None)
+            if matrices:
+                matrix = matrices.pop()
+                self.idle[key] = matrices
+                return matrix
+            elif matrices is not None:
+                self.idle[key] = matrices
+
+        # Build outside the lock; construction is the slow part.
+        return self.engine("0" * n**2, n, boxWidth)
+
+    def checkin(self, matrix):
+        """Reset matrix and return it to the pool."""
+        # A contradictory grid leaves the links scrambled, so the matrix
+        # is dropped without unwinding it.
+        if matrix.tainted:
+            return
+
+        while matrix.choices != []:
+            matrix.backtrack()
+
+        key = (matrix.n, matrix.boxWidth)
+        with self.lock:
+            matrices = self.idle.pop(key, [])
+            if len(matrices) < self.maxIdle:
+                matrices.append(matrix)
+            self.idle[key] = matrices
+
+            while len(self.idle) > self.maxSizes:
+                self.idle.popitem(last=False)
+
+    def warm(self, sizes, count=1):
+        """Build and pool count matrices for each (n, boxWidth) in sizes."""
+        for n, boxWidth in sizes:
+            matrices = [self.checkout(n, boxWidth) for i in xrange(count)]
+            for matrix in matrices:
+                self.checkin(matrix)
+
+################################## Snapshots ##################################
+
+# Directory of the snapshots array engines are restored from, if any.
+_SNAPSHOT_DIR = None
+
+# Snapshots begin with this magic string and the length of their header.
+_SNAPSHOT_MAGIC = 'SDKS'
+_SNAPSHOT_PREFIX = len(_SNAPSHOT_MAGIC) + 4
+
+# Version of the snapshot format, raised whenever the layout of the link
+# arrays changes so that older snapshots are seen to be stale.
+_SNAPSHOT_VERSION = 1
+
+def use_snapshots(directory):
+    """Restore every new empty array engine matrix from directory.
+
+    Building the link arrays of a large grid takes seconds; restoring
+    them from a snapshot written by write_snapshot takes milliseconds. A
+    size or engine with no snapshot in directory, or with a stale one, is
+    built as before. None stops the use of snapshots.
+
+    """
+    global _SNAPSHOT_DIR
+    _SNAPSHOT_DIR = directory
+
+def snapshot_path(directory, engine, n, boxWidth):
+    """Return the path of the snapshot of an n x n grid for engine."""
+    return os.path.join(directory, '%s-%dx%d.snapshot' % (engine, n,
+                                                         boxWidth))
+
+def write_snapshot(directory, n=_N, boxWidth=_BOX_WIDTH, engine='array'):
+    """Save the link arrays of an empty matrix to a snapshot file.
+
+    The file holds a JSON header, giving the format's version, the
+    engine, the size of the grid, the layout of every array, and the
+    CRC-32 of their contents, followed by the arrays themselves. Only the
+    array engines can be saved. Returns the path of the snapshot.
+
+    >>> import tempfile
+    >>> directory = tempfile.mkdtemp()
+    >>> path = write_snapshot(directory, 4, 2, 'array-buckets')
+    >>> use_snapshots(directory)
+    >>> restore_snapshot(ArrayBucketMatrix('0' * 16, 4, 2), directory)
+    True
+    >>> ArrayBucketMatrix('0' * 16, 4, 2, 300).count_solutions()
+    288
+    >>> use_snapshots(None)
+
+    """
+    cls = ENGINES[engine]
+    if not hasattr(cls, 'snapshotArrays'):
+        raise ValueError('the %s engine cannot be snapshotted' % engine)
+    matrix = cls("0" * n**2, n, boxWidth)
+
+    layout = []
+    contents = []
+    for name in cls.snapshotArrays:
+        value = getattr(matrix, name)
+        if isinstance(value, bytearray):
+            layout.append([name, 'bytearray', 1, len(value)])
+            contents.append(str(value))
+        else:
+            layout.append([name, value.typecode, value.itemsize,
+                           len(value) * value.itemsize])
+            contents.append(value.tostring())
+    payload = ''.join(contents)
+
+    header = json.dumps({
+        'version': _SNAPSHOT_VERSION,
+        'engine': cls.__name__,
+        'n': n,
+        'boxWidth': boxWidth,
+        'byteorder': sys.byteorder,
+        'arrays': layout,
+        'crc32': zlib.crc32(payload) & 0xffffffff,
+    }, sort_keys=True)
+
+    # Written under another name first, so that a reader never maps a
+    # snapshot which is only partly written.
+    path = snapshot_path(directory, engine, n, boxWidth)
+    partial = '%s.%d' % (path, os.getpid())
+    with open(partial, 'wb') as f:
+        f.write(_SNAPSHOT_MAGIC)
+        f.write(struct.pack('<I', len(header)))
+        f.write(header)
+        f.write(payload)
+    os.rename(partial, path)
+    return path
+
+def restore_snapshot(matrix, directory):
+    """Restore the link arrays of an empty array engine matrix.
+
+    Returns False, leaving matrix untouched, if directory has no
+    snapshot for its engine and size. A stale or damaged snapshot is
+    reported on stderr and likewise ignored.
+
+    """
+    cls = matrix.__class__
+    engine = [name for name, value in ENGINES.iteritems()
+              if value is cls]
+    if not engine or not hasattr(cls, 'snapshotArrays'):
+        return False
+    path = snapshot_path(directory, engine[0], matrix.n, matrix.boxWidth)
+
+    try:
+        f = open(path, 'rb')
+    except IOError:
+        return False
+
+    with f:
+        try:
+            snapshot = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, mmap.error):
+            return _stale(path, 'it is empty')
+
+        try:
+            return _restore(matrix, snapshot, path)
+        finally:
+            snapshot.close()
+
+def _restore(matrix, snapshot, path):
+    """Restore matrix from the mapped snapshot at path if it is current."""
+    if (len(snapshot) < _SNAPSHOT_PREFIX or
+        snapshot[:len(_SNAPSHOT_MAGIC)] != _SNAPSHOT_MAGIC):
+        return _stale(path, 'it is not a snapshot')
+    length, = struct.unpack_from('<I', snapshot, len(_SNAPSHOT_MAGIC))
+    offset = _SNAPSHOT_PREFIX + length
+    try:
+        header = json.loads(snapshot[_SNAPSHOT_PREFIX:offset])
+    except ValueError:
+        return _stale(path, 'its header is damaged')
+
+    expected = {'version': _SNAPSHOT_VERSION,
+                'engine': matrix.__class__.__name__,
+                'n': matrix.n,
+                'boxWidth': matrix.boxWidth,
+                'byteorder': sys.byteorder}
+    for key, value in sorted(expected.iteritems()):
+        if header.get(key) != value:
+            return _stale(path, 'its %s is %r, not %r'
+                          % (key, header.get(key), value))
+
+    names = [name for name, typecode, itemsize, size in header['arrays']]
+    if names != list(matrix.snapshotArrays):
+        return _stale(path, 'it holds the arrays %s' % ', '.join(names))
+    if offset + sum(size for name, typecode, itemsize, size
+                    in header['arrays']) != len(snapshot):
+        return _stale(path, 'it is truncated')
+    crc = zlib.crc32(buffer(snapshot, offset)) & 0xffffffff
+    if crc != header['crc32']:
+        return _stale(path, 'its checksum does not match')
+
+    arrays = {}
+    for name, typecode, itemsize, size in header['arrays']:
+        contents = buffer(snapshot, offset, size)
+        offset += size
+        if typecode == 'bytearray':
+            arrays[name] = bytearray(contents)
+        else:
+            value = array(str(typecode))
+            if value.itemsize != itemsize:
+                return _stale(path, 'its %s array has items of %d bytes'
+                              % (name, itemsize))
+            value.fromstring(contents)
+            arrays[name] = value
+
+    for name, value in arrays.iteritems():
+        setattr(matrix, name, value)
+    matrix.firstNode = 4 * matrix.n**2 + 1
+    return True
+
+def _stale(path, reason):
+    """Report that the snapshot at path is ignored; return False."""
+    sys.stderr.write('ignoring snapshot %s: %s\n' % (path, reason))
+    return False
+
+################################# Propagation #################################
+
+# Maps (n, boxWidth) to the tables built by unit_tables.
+_UNIT_TABLES = {}
+
+def unit_tables(n, boxWidth):
+    """Return the units and peers of every cell of an n x n grid.
+
+    The result is a tuple (units, cellUnits, peers). units lists the
+    cells of every row, then every column, then every box. cellUnits[cell]
+    holds the indices of the row, column, and box containing the cell,
+    and peers[cell] every other cell sharing one of them.
+
+    Tables are built once per (n, boxWidth) and shared thereafter.
+
+    """
+    key = (n, boxWidth)
+    if key in _UNIT_TABLES:
+        return _UNIT_TABLES[key]
+
+    boxHeight = n // boxWidth
+    units = [[] for i in xrange(3 * n)]
+    cellUnits = []
+
+    for row in xrange(n):
+        for col in xrange(n):
+            box = col // boxWidth + boxHeight * (row // boxHeight)
+            cell = row * n + col
+            ids = (row, n + col, 2 * n + box)
+            for unit in ids:
+                units[unit].append(cell)
+            cellUnits.append(ids)
+
+    peers = []
+    for cell in xrange(n**2):
+        others = set()
+        for unit in cellUnits[cell]:
+            others.update(units[unit])
+        others.discard(cell)
+        peers.append(tuple(sorted(others)))
+
+    tables = (units, cellUnits, peers)
+    _UNIT_TABLES[key] = tables
+    return tables
+
+def propagate_singles(L, n=_N, boxWidth=_BOX_WIDTH):
+    """Fill in every cell of L which is forced by naked or hidden singles.
+
+    A naked single is a cell with only one possible digit left; a hidden
+    single is a digit with only one possible cell left in some row, column,
+    or box. Each unit keeps a bitmask of the digits placed in it and each
+    cell a bitmask of the digits it may still take.
+
+    Returns a tuple (grid, settled), where grid is a list of n**2 integers
+    with the forced cells filled in and settled is the number of cells
+    propagation filled. grid is None if L contradicts itself.
+
+    Raises CellViolation if a cell holds a digit greater than n.
+
+    >>> grid, settled = propagate_singles('\
+530070000\
+600195000\
+098000060\
+800060003\
+400803001\
+700020006\
+060000280\
+000419005\
+000080079')
+    >>> settled, 0 in grid
+    (51, False)
+    >>> propagate_singles('55' + '0'*79)
+    (None, 0)
+
+    """
+    L = grid_cells(L, n)
+    units, cellUnits, peers = unit_tables(n, boxWidth)
+    full = (1 << n) - 1
+
+    grid = [0] * n**2
+    placed = [0] * (3 * n)                # Digits placed in each unit
+    candidates = [full] * n**2            # Digits each cell may take
+    queue = []                            # Cells to fill in, as (cell, bit)
+
+    for cell in xrange(n**2):
+        digit = parse_digit(L[cell], n)
+        if digit > n:
+            raise CellViolation(cell // n, cell % n, digit, n)
+        if digit != 0:
+            queue.append((cell, 1 << (digit - 1)))
+    givens = len(queue)
+
+    settled = 0
+    while queue:
+        while queue:
+            cell, bit = queue.pop()
+            if grid[cell]:
+                if grid[cell] != bit.bit_length():
+                    return None, max(settled - givens, 0)
+                continue
+
+            # The digit must still be possible in the cell.
+            if not candidates[cell] & bit:
+                return None, max(settled - givens, 0)
+
+            grid[cell] = bit.bit_length()
+            candidates[cell] = bit
+            settled += 1
+            for unit in cellUnits[cell]:
+                placed[unit] |= bit
+
+            # Remove the digit from every peer, queueing naked singles.
+            for peer in peers[cell]:
+                if candidates[peer] & bit and not grid[peer]:
+                    remaining = candidates[peer] & ~bit
+                    if remaining == 0:
+                        return None, max(settled - givens, 0)
+                    candidates[peer] = remaining
+                    if remaining & (remaining - 1) == 0:
+                        queue.append((peer, remaining))
+
+        # Look for hidden singles once no naked singles remain.
+        for unit in xrange(3 * n):
+            missing = full & ~placed[unit]
+            if not missing:
+                continue
+
+            once = twice = 0
+            for cell in units[unit]:
+                if not grid[cell]:
+                    twice |= once & candidates[cell]
+                    once |= candidates[cell]
+
+            # Some digit has nowhere left to go.
+            if missing & ~once:
+                return None, max(settled - givens, 0)
+
+            hidden = missing & ~twice
+            if hidden:
+                for cell in units[unit]:
+                    if not grid[cell] and candidates[cell] & hidden:
+                        bits = candidates[cell] & hidden
+                        while bits:
+                            queue.append((cell, bits & -bits))
+                            bits &= bits - 1
+                break
+
+    return grid, settled - givens
+
+################################### Sessions ##################################
+
+class SolvingSession:
+    """A puzzle kept alive in its matrix across single-cell edits.
+
+    Rather than building and solving a new matrix each time one cell of
+    the puzzle changes, a SolvingSession applies the change to the matrix
+    it already holds: filling a cell chooses its Candidate and clearing a
+    cell unchooses it with remove_filled_cell. Only the search for
+    solutions is repeated.
+
+    A cell which contradicts the cells already filled is remembered but
+    not chosen until the contradiction is cleared; meanwhile the puzzle
+    has no solution.
+
+    >>> session = SolvingSession(original_grid='0' * 80 + '9')
+    >>> session.result() == session.original_grid
+    True
+    >>> session.update('\
+530070000\
+600195000\
+098000060\
+800060003\
+400803001\
+700020006\
+060000280\
+000419005\
+000080079')
+    >>> session.result()[:9]
+    '534678912'
+    >>> session.set_cell(0, 1, 5)
+    >>> session.result() == session.original_grid
+    True
+    >>> session.set_cell(0, 1, 3)
+    >>> session.clear_cell(0, 0)
+    >>> session.result()[:9]
+    '534678912'
+
+    """
+    def __init__(self, n=_N, boxWidth=_BOX_WIDTH, original_grid=None,
+                 engine=_ENGINE, pool=None):
+        """Create a session for an n x n grid.
+
+        Keyword Arguments:
+
+        original_grid: the grid to start from; empty if None.
+        engine: the name of the engine in ENGINES to build the matrix with.
+        pool: an optional MatrixPool to borrow the matrix from instead.
+
+        """
+        self.n = n
+        self.boxWidth = boxWidth
+        self.pool = pool
+        if pool is None:
+            self.matrix = ENGINES[engine]("0" * n**2, n, boxWidth)
+        else:
+            self.matrix = pool.checkout(n, boxWidth)
+
+        # The digit entered in every cell, whether chosen or not.
+        self.grid = [0] * n**2
+
+        # Filled cells which contradict the chosen ones.
+        self.conflicts = set()
+
+        self.original_grid = "0" * n**2
+        self.solution = None
+
+        # The last solution found, which the next search tries first.
+        self.hint = None
+        self.lastUsed = time.time()
+        self.lock = threading.Lock()
+
+        if original_grid is not None:
+            self.update(original_grid)
+
+    def close(self):
+        """Return the session's matrix to its pool."""
+        if self.pool is not None and self.matrix is not None:
+            self.pool.checkin(self.matrix)
+        self.matrix = None
+
+    def update(self, L):
+        """Apply every cell of L which differs from the session's grid.
+
+        Cells which are malformed, or missing from a short L, are taken
+        to be empty.
+
+        >>> session = SolvingSession(4, 2, original_grid='1,x,3')
+        >>> session.grid
+        [1, 0, 3, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0]
+
+        """
+        L = grid_cells(L, self.n)
+        changes = []
+        for location in xrange(self.n**2):
+            digit = 0
+            if location < len(L):
+                try:
+                    digit = parse_digit(L[location], self.n)
+                except ValueError:
+                    pass
+            if digit > self.n:
+                digit = 0
+            if digit != self.grid[location]:
+                changes.append((location, digit))
+
+        # Clear cells before filling others, so no conflict is reported
+        # for a cell which was about to be cleared anyway.
+        for location, digit in changes:
+            if self.grid[location]:
+                self.clear_cell(location // self.n, location % self.n)
+        for location, digit in changes:
+            if digit:
+                self.set_cell(location // self.n, location % self.n, digit)
+
+        self.original_grid = L
+
+    def set_cell(self, row, col, digit):
+        """Fill the cell at (row, col) with digit."""
+        if digit > self.n:
+            raise CellViolation(row, col, digit, self.n)
+
+        location = row * self.n + col
+        if self.grid[location]:
+            self.clear_cell(row, col)
+
+        self.grid[location] = digit
+        index = location * self.n + digit - 1
+        if self.matrix.is_available(index):
+            self.matrix.choose(index)
+        else:
+            self.conflicts.add(location)
+        self.edited()
+
+    def clear_cell(self, row, col):
+        """Empty the cell at (row, col)."""
+        location = row * self.n + col
+        if not self.grid[location]:
+            return
+
+        self.grid[location] = 0
+        if location in self.conflicts:
+            self.conflicts.remove(location)
+        else:
+            self.matrix.remove_filled_cell(row, col)
+
+            # The cleared cell may have been what blocked a conflict.
+            for location in sorted(self.conflicts):
+                index = location * self.n + self.grid[location] - 1
+                if self.matrix.is_available(index):
+                    self.matrix.choose(index)
+                    self.conflicts.remove(location)
+        self.edited()
+
+    def edited(self):
+        """Forget the previous result after a change to the grid."""
+        self.original_grid = format_grid(self.grid, self.n)
+        self.solution = None
+
+    def result(self, maxNodes=None, deadline=None):
+        """Return the unique solution, or the grid if there is none.
+
+        The answer matches find_solutions for the same grid and budget.
+        After an edit, the search tries the last solution found first, so
+        that a solution differing from it in a few cells is found with
+        little backtracking.
+
+        """
+        self.lastUsed = time.time()
+        if self.conflicts:
+            return self.original_grid
+
+        if self.solution is None:
+            search = self.matrix.counting_search(self.matrix, 2, self.hint)
+            search.run(maxNodes, deadline)
+            if search.first is not None:
+                self.hint = self.matrix.get_string(search.first)
+            if search.exhausted:
+                # Try again in full next time.
+                return self.original_grid
+            elif search.count == 1:
+                self.solution = self.hint
+            else:
+                self.solution = False
+        return self.solution or self.original_grid
+
+class SessionStore:
+    """A thread-safe collection of SolvingSessions addressed by id.
+
+    Sessions idle for more than timeout seconds are expired, as is the
+    least recently used session once more than maxSessions exist.
+
+    >>> store = SessionStore()
+    >>> sessionId = store.create(9, 3)
+    >>> store.get(sessionId).n
+    9
+    >>> store.discard(sessionId)
+    >>> store.get(sessionId) is None
+    True
+
+    """
+    def __init__(self, timeout=600, maxSessions=1000, pool=None):
+        """Create an empty SessionStore drawing matrices from pool."""
+        self.timeout = timeout
+        self.maxSessions = maxSessions
+        self.pool = pool
+
+        # Maps ids to sessions, least recently used first.
+        self.sessions = OrderedDict()
+        self.lock = threading.Lock()
+
+    def create(self, n=_N, boxWidth=_BOX_WIDTH, original_grid=None):
+        """Start a new session and return its id."""
+        session = SolvingSession(n, boxWidth, original_grid, pool=self.pool)
+        sessionId = uuid.uuid4().hex
+        with self.lock:
+            self.sessions[sessionId] = session
+        self.expire()
+        return sessionId
+
+    def get(self, sessionId):
+        """Return the session with the given id, or None if it expired."""
+        self.expire()
+        with self.lock:
+            session = self.sessions.pop(sessionId, None)
+            if session is not None:
+                session.lastUsed = time.time()
+                self.sessions[sessionId] = session
+        return session
+
+    def discard(self, sessionId):
+        """End the session with the given id."""
+        with self.lock:
+            session = self.sessions.pop(sessionId, None)
+        if session is not None:
+            with session.lock:
+                session.close()
+
+    def expire(self):
+        """End idle sessions and any beyond maxSessions."""
+        cutoff = time.time() - self.timeout
+        expired = []
+        with self.lock:
+            for sessionId, session in self.sessions.items():
+                if (session.lastUsed < cutoff or
+                    len(self.sessions) > self.maxSessions):
+                    expired.append(self.sessions.pop(sessionId))
+                else:
+                    break
+        for session in expired:
+            with session.lock:
+                session.close()
+
+################################ Solution Cache ###############################
+
+# Canonical forms are abandoned when more than this many arrangements of
+# rows and columns would have to be compared.
+_CANONICAL_LIMIT = 64
+
+def canonical_form(L, n=_N, boxWidth=_BOX_WIDTH):
+    """Return a canonical representative of the grid L and its transform.
+
+    Two grids related by relabelling digits, permuting bands or stacks,
+    permuting rows within a band or columns within a stack, or (for
+    square boxes) transposing have the same canonical form, so their
+    solutions can be shared.
+
+    Rows and columns are first sorted by signatures which none of those
+    transformations change, refined from the number of times each digit
+    is given. Arrangements which the signatures cannot tell apart are
+    compared exhaustively, and the canonical form is the least of them
+    once digits are relabelled in order of appearance.
+
+    Returns a tuple (key, transform), or None if L contradicts itself,
+    holds an invalid digit, or is too symmetric to canonicalize within
+    _CANONICAL_LIMIT arrangements.
+
+    >>> puzzle = ('530070000600195000098000060'
+    ...           '800060003400803001700020006'
+    ...           '060000280000419005000080079')
+    >>> relabelled = ''.join(str(-int(digit) % 10) for digit in puzzle)
+    >>> transposed = ''.join(relabelled[c * 9 + r] for r in xrange(9)
+    ...                      for c in xrange(9))
+    >>> canonical_form(puzzle)[0] == canonical_form(transposed)[0]
+    True
+
+    """
+    boxHeight = n // boxWidth
+    try:
+        grid = [parse_digit(digit, n) for digit in grid_cells(L, n)]
+    except ValueError:
+        return None
+    if len(grid) != n**2 or max(grid) > n:
+        return None
+
+    # Reject contradictions, which the engines do not solve faithfully.
+    units = unit_tables(n, boxWidth)[0]
+    for unit in units:
+        digits = [grid[cell] for cell in unit if grid[cell]]
+        if len(digits) != len(set(digits)):
+            return None
+
+    orientations = [False]
+    if boxWidth == boxHeight:
+        orientations.append(True)
+
+    best = None
+    for transposed in orientations:
+        if transposed:
+            work = [grid[c * n + r] for r in xrange(n) for c in xrange(n)]
+        else:
+            work = grid
+        arrangements = _arrangements(work, n, boxWidth)
+        if arrangements is None:
+            return None
+
+        for rowOrder, colOrder in arrangements:
+            relabel = {0: 0}
+            cells = []
+            for row in rowOrder:
+                for col in colOrder:
+                    digit = work[row * n + col]
+                    if digit not in relabel:
+                        relabel[digit] = len(relabel)
+                    cells.append(relabel[digit])
+            if best is None or cells < best[0]:
+                best = (cells, (transposed, rowOrder, colOrder, relabel))
+
+    cells, transform = best
+    key = format_grid(cells, n)
+    return key, transform
+
+def _arrangements(grid, n, boxWidth):
+    """List the (rowOrder, colOrder) pairs canonical_form must compare."""
+    boxHeight = n // boxWidth
+
+    count = [0] * (n + 1)
+    for digit in grid:
+        count[digit] += 1
+
+    def ranks(sigs):
+        """Replace each signature by its rank among the distinct ones."""
+        rank = dict((sig, i) for i, sig in enumerate(sorted(set(sigs))))
+        return [rank[sig] for sig in sigs]
+
+    # Refine row and column signatures until they stop splitting.
+    rowSig = [0] * n
+    colSig = [0] * n
+    classes = 0
+    while True:
+        rowSig, colSig = (
+            ranks([(rowSig[r], tuple(sorted((colSig[c],
+                                             count[grid[r * n + c]])
+                                            for c in xrange(n)
+                                            if grid[r * n + c])))
+                   for r in xrange(n)]),
+            ranks([(colSig[c], tuple(sorted((rowSig[r],
+                                             count[grid[r * n + c]])
+                                            for r in xrange(n)
+                                            if grid[r * n + c])))
+                   for c in xrange(n)]))
+        refined = len(set(rowSig)) + len(set(colSig))
+        if refined == classes:
+            break
+        classes = refined
+
+    # Rows come in bands of boxHeight; columns in stacks of boxWidth.
+    rowOrders = _orderings(rowSig, boxWidth, boxHeight)
+    colOrders = _orderings(colSig, boxHeight, boxWidth)
+    if (rowOrders is None or colOrders is None or
+        len(rowOrders) * len(colOrders) > _CANONICAL_LIMIT):
+        return None
+    return [(rows, cols) for rows in rowOrders for cols in colOrders]
+
+def _orderings(sig, groups, size):
+    """List the orders of lines which sort groups of lines by signature.
+
+    Lines are divided into groups of size consecutive lines. Groups are
+    sorted by their sorted signatures and lines within each group by
+    their own signatures; lines or groups with equal signatures may come
+    in any order, so every such order is listed.
+
+    """
+    def ties(items, key):
+        """Return every order of items sorted by key, ties permuted."""
+        items = sorted(items, key=key)
+        runs = [list(run) for k, run in itertools.groupby(items, key)]
+        total = 1
+        for run in runs:
+            for i in xrange(2, len(run) + 1):
+                total *= i
+        if total > _CANONICAL_LIMIT:
+            return None
+        return [sum(choice, []) for choice in itertools.product(
+            *[[list(p) for p in itertools.permutations(run)]
+              for run in runs])]
+
+    lineOrders = []
+    for group in xrange(groups):
+        lines = range(group * size, (group + 1) * size)
+        orders = ties(lines, lambda line: sig[line])
+        if orders is None:
+            return None
+        lineOrders.append(orders)
+
+    groupSig = [tuple(sorted(sig[line] for line in
+                             xrange(group * size, (group + 1) * size)))
+                for group in xrange(groups)]
+    groupOrders = ties(range(groups), lambda group: groupSig[group])
+    if groupOrders is None:
+        return None
+
+    orderings = []
+    for groupOrder in groupOrders:
+        for choice in itertools.product(*[lineOrders[group]
+                                          for group in groupOrder]):
+            orderings.append(sum(choice, []))
+            if len(orderings) > _CANONICAL_LIMIT:
+                return None
+    return orderings
+
+def canonical_solution(solution, n, transform):
+    """Map a solution of the original grid onto its canonical form."""
+    transposed, rowOrder, colOrder, relabel = transform
+    solution = grid_cells(solution, n)
+
+    # Digits never given take the next free labels, in order.
+    relabel = dict(relabel)
+    for digit in xrange(1, n + 1):
+        if digit not in relabel:
+            relabel[digit] = len(relabel)
+
+    cells = []
+    for row in rowOrder:
+        for col in colOrder:
+            if transposed:
+                digit = solution[col * n + row]
+            else:
+                digit = solution[row * n + col]
+            cells.append(relabel[parse_digit(digit, n)])
+    return format_grid(cells, n)
+
+def from_canonical(solution, n, transform):
+    """Map a solution of a canonical form back onto the original grid."""
+    transposed, rowOrder, colOrder, relabel = transform
+    solution = grid_cells(solution, n)
+
+    # Labels never given pair off with digits never given; a grid missing
+    # two digits cannot have a unique solution anyway.
+    unlabel = dict((label, digit) for digit, label in relabel.iteritems())
+    unused = [digit for digit in xrange(1, n + 1) if digit not in relabel]
+    for label in xrange(1, n + 1):
+        if label not in unlabel:
+            unlabel[label] = unused.pop(0)
+
+    cells = [0] * n**2
+    for i, row in enumerate(rowOrder):
+        for j, col in enumerate(colOrder):
+            digit = unlabel[parse_digit(solution[i * n + j], n)]
+            if transposed:
+                cells[col * n + row] = digit
+            else:
+                cells[row * n + col] = digit
+    return format_grid(cells, n)
+
+class SolutionCache:
+    """A thread-safe LRU cache of solutions keyed by canonical form.
+
+    Each entry maps the canonical form of a grid to the solution of that
+    canonical form, or to None if it has no unique solution. A grid which
+    is merely a relabelled or rearranged copy of a cached one is answered
+    by mapping the cached solution back through its transform.
+
+    >>> cache = SolutionCache(maxEntries=1)
+    >>> puzzle = ('530070000600195000098000060'
+    ...           '800060003400803001700020006'
+    ...           '060000280000419005000080079')
+    >>> swapped = puzzle[27:54] + puzzle[:27] + puzzle[54:]
+    >>> find_solutions(puzzle, cache=cache)[:9]
+    '534678912'
+    >>> find_solutions(swapped, cache=cache)[27:36]
+    '534678912'
+    >>> cache.hits, cache.misses, cache.evictions
+    (1, 1, 0)
+
+    """
+    def __init__(self, maxEntries=10000):
+        """Create an empty SolutionCache holding at most maxEntries."""
+        self.maxEntries = maxEntries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """Return (True, value) for a cached key, else (False, None)."""
+        with self.lock:
+            if key in self.entries:
+                value = self.entries.pop(key)
+                self.entries[key] = value
+                self.hits += 1
+                return True, value
+            self.misses += 1
+            return False, None
+
+    def put(self, key, value):
+        """Cache value under key, evicting the least recently used entry."""
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = value
+            while len(self.entries) > self.maxEntries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
 ############################## Utility Functions ##############################
                 
+def parse_digit(digit, n):
+    """Convert a cell of an input grid to an integer.
+
+    Strings are read in base n + 1, except for strings longer than one
+    character, and any string once n + 1 is past the base of the last of
+    _DIGITS, which are read in base 10.
+
+    >>> parse_digit('A', 12), parse_digit('10', 12), parse_digit(7, 9)
+    (10, 10, 7)
+    >>> parse_digit('7', 49)
+    7
+
+    """
+    if type(digit) == type(str()):
+        # give user the benefit of the doubt that digit <= n.
+        if len(digit) > 1 or n > len(_DIGITS):
+            digit = int(digit)
+        else:
+            digit = int(digit, n + 1)
+    return digit
+
+def hint_candidates(hint, n):
+    """Return the set of Candidate numbers filled in the grid hint.
+
+    Cells which are empty or do not hold a digit up to n are skipped.
+
+    >>> sorted(hint_candidates('1' + '0' * 79 + 'Z', 9))
+    [0]
+
+    """
+    hint = grid_cells(hint, n)
+    candidates = set()
+    for location in xrange(n**2):
+        try:
+            digit = parse_digit(hint[location], n)
+        except (ValueError, IndexError):
+            continue
+        if 0 < digit <= n:
+            candidates.add(location * n + digit - 1)
+    return candidates
+
+def grid_cells(L, n):
+    """Return the grid L with one entry per cell.
+
+    A string of anything but n**2 characters is taken to be in the
+    delimited form of format_grid, and split into its cells; their
+    digits are then read in base 10 by parse_digit. Any other L is
+    returned as it is.
+
+    >>> grid_cells('1,0,4, 3', 2)
+    ['1', '0', '4', '3']
+    >>> grid_cells('1043', 2)
+    '1043'
+
+    """
+    if isinstance(L, basestring) and len(L) != n**2:
+        return L.replace(_SEPARATOR, " ").split()
+    return L
+
+def format_grid(cells, n):
+    """Render a sequence of n**2 integers, 0 for an empty cell, as a grid.
+
+    Grids of n <= 35 take a character per cell. Larger grids list their
+    cells in decimal, separated by _SEPARATOR.
+
+    >>> format_grid([1, 0, 10, 2], 2)
+    '10A2'
+    >>> format_grid([36, 0] + [0] * 1294, 36)[:6]
+    '36,0,0'
+
+    """
+    if n <= len(_DIGITS):
+        return "".join([digit and _DIGITS[digit - 1] or "0"
+                        for digit in cells])
+    return _SEPARATOR.join(map(str, cells))
+
 def pretty_print(gridString):
     """Format the gridString as a Sudoku Grid."""
     from math import sqrt
-    n = int(sqrt(len(gridString)))
+    if _SEPARATOR in gridString:
+        cells = gridString.split(_SEPARATOR)
+    else:
+        cells = list(gridString)
+    n = int(sqrt(len(cells)))
+    width = max(len(cell) for cell in cells)
     s = ""
 
     for row in xrange(n):
         for col in xrange(n):
-            cellValue = gridString[row * n + col]
+            cellValue = cells[row * n + col]
 
             if cellValue == "0":
-                s += "  "
+                s += " " * width + " "
             else:
-                s += "%s " % (cellValue)
+                s += "%*s " % (width, cellValue)
         s += "\n"
     return s
 
@@ -743,10 +3821,12 @@ if __name__ == "__main__":
         # Optional argument boxWidth
         boxWidth = int(args.getfirst('boxWidth', _BOX_WIDTH))
 
-        # Fail silently
+        # Fail silently, but leave a trace in the server's error log.
         try:
             print find_solutions(original_grid, n, boxWidth)
         except Exception:
+            import traceback
+            traceback.print_exc()
             print original_grid
         
     # No arguments, so do a doctest.
@@ -0,0 +1,440 @@
+#!/usr/local/bin/python
+# -*- coding: utf-8 -*-
+
+"""Batch solving of many Sudoku puzzles across processes.
+
+solve_many reads puzzles lazily from any iterable, hands them in chunks
+to a pool of worker processes, and yields a BatchResult for each one,
+either in input order or as soon as it is finished. Each worker keeps a
+MatrixPool, so matrices are built once per process rather than once per
+puzzle. Only a bounded number of chunks is in flight at a time, so
+arbitrarily long inputs are streamed rather than read into memory.
+
+Run as a script, it reads puzzles one per line from a file or stdin and
+writes one answer per line to stdout, as find_solutions would give it:
+
+    python sudoku_batch.py puzzles.txt --workers 8 > solutions.txt
+
+With vectorize, each chunk is first propagated as a whole: propagate_batch
+fills in naked and hidden singles of every puzzle of the chunk at once
+with NumPy, and only the puzzles left unfinished are searched. The
+answers are those of find_solutions either way. Without NumPy, or for
+grids too large for the int64 bitmasks of propagate_batch, vectorize falls
+back to propagating each puzzle with propagate_singles.
+
+>>> puzzles = ['0' * 80 + '9', '55' + '0' * 79]
+>>> [r.status for r in solve_many(puzzles, workers=0)]
+['multiple', 'none']
+>>> [r.index for r in solve_many(puzzles, workers=2, chunksize=1)]
+[0, 1]
+>>> [r.status for r in solve_many(puzzles, workers=0, vectorize=True)]
+['multiple', 'none']
+
+"""
+
+import sys
+import time
+import itertools
+import multiprocessing
+from collections import deque
+import Queue
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+import sudoku
+
+# Number of puzzles sent to a worker at a time.
+_CHUNKSIZE = 64
+
+# The MatrixPool of a worker process, created by _init_worker.
+_WORKER_POOL = None
+
+# The largest n whose candidate bitmasks fit the int64 arrays of
+# propagate_batch.
+_MAX_VECTOR_N = 62
+
+class BatchResult:
+    """The outcome of solving one puzzle of a batch.
+
+    index: the position of the puzzle in the input.
+    puzzle: the puzzle as given.
+    answer: what find_solutions returns: the unique solution, or the
+    puzzle itself.
+    status: the status of the SolveResult: unique, multiple, none, or
+    unknown.
+    nodes: the number of search nodes visited.
+    elapsed: the seconds spent solving the puzzle.
+
+    """
+    def __init__(self, index, puzzle, result):
+        """Summarize the SolveResult of the puzzle at index."""
+        self.index = index
+        self.puzzle = puzzle
+        self.status = result.status
+        self.nodes = result.nodes
+        self.elapsed = result.elapsed
+        if not result.exhausted and result.count == 1:
+            self.answer = result.solution
+        else:
+            self.answer = puzzle
+
+    def __repr__(self):
+        """String representation of the BatchResult."""
+        return ("<BatchResult %d %s: %d nodes, %.3fs>" %
+                (self.index, self.status, self.nodes, self.elapsed))
+
+def _init_worker(engine):
+    """Give the worker process a MatrixPool of its own."""
+    global _WORKER_POOL
+    _WORKER_POOL = sudoku.MatrixPool(engine)
+
+def _solve_chunk(chunk, options):
+    """Solve a list of (index, puzzle) pairs with the worker's pool."""
+    n, boxWidth, propagate, vectorize, maxNodes, timeLimit = options
+    if vectorize:
+        return _solve_vectorized(chunk, options)
+
+    results = []
+    for index, puzzle in chunk:
+        result = _analyze(puzzle, n, boxWidth, propagate, maxNodes,
+                          timeLimit)
+        results.append(BatchResult(index, puzzle, result))
+    return results
+
+def _solve_chunk_caught(chunk, options):
+    """Run _solve_chunk, returning rather than raising its exception.
+
+    Unordered chunks are only heard of through their callback, which a
+    raising chunk would never reach; _collect raises the exception again.
+
+    """
+    try:
+        return _solve_chunk(chunk, options)
+    except Exception, e:
+        return e
+
+def _analyze(puzzle, n, boxWidth, propagate, maxNodes, timeLimit):
+    """Return the SolveResult of one puzzle, searched within its budget."""
+    deadline = None
+    if timeLimit is not None:
+        deadline = time.time() + timeLimit
+    try:
+        return sudoku.analyze(puzzle, n, boxWidth, pool=_WORKER_POOL,
+                              propagate=propagate, maxNodes=maxNodes,
+                              deadline=deadline)
+    except Exception:
+        # A malformed puzzle answers with itself, as find_solutions
+        # would in the CGI script.
+        return sudoku.SolveResult()
+
+def _solve_vectorized(chunk, options):
+    """Propagate a chunk with propagate_batch, then search what is left."""
+    n, boxWidth, propagate, vectorize, maxNodes, timeLimit = options
+    if numpy is None or n > _MAX_VECTOR_N:
+        return _solve_chunk(chunk, (n, boxWidth, True, False, maxNodes,
+                                    timeLimit))
+
+    started = time.time()
+    grids = []
+    for index, puzzle in chunk:
+        grids.append(_parse(puzzle, n))
+    valid = [grid for grid in grids if grid is not None]
+    if valid:
+        filled, states = propagate_batch(valid, n, boxWidth)
+    share = (time.time() - started) / len(chunk)
+
+    results = []
+    k = 0
+    for (index, puzzle), grid in zip(chunk, grids):
+        if grid is None:
+            # Let analyze report the malformed puzzle as usual.
+            result = _analyze(puzzle, n, boxWidth, False, maxNodes,
+                              timeLimit)
+        else:
+            state = states[k]
+            known = filled[k].tolist()
+            k += 1
+            begun = time.time()
+            if state == CONTRADICTION:
+                result = sudoku.SolveResult().finish(0, None, False, begun)
+            elif state == SOLVED:
+                solution = sudoku.format_grid(known, n)
+                result = sudoku.SolveResult().finish(1, solution, False,
+                                                     begun)
+            else:
+                result = _analyze(known, n, boxWidth, False, maxNodes,
+                                  timeLimit)
+                result.settled = (n**2 - known.count(0) -
+                                  (n**2 - grid.count(0)))
+        result.elapsed += share
+        results.append(BatchResult(index, puzzle, result))
+    return results
+
+def _parse(puzzle, n):
+    """Return puzzle as a list of n**2 integers, or None if malformed."""
+    try:
+        grid = [sudoku.parse_digit(digit, n)
+                for digit in sudoku.grid_cells(puzzle, n)]
+    except ValueError:
+        return None
+    if len(grid) != n**2 or [digit for digit in grid if digit > n]:
+        return None
+    return grid
+
+def _chunks(puzzles, chunksize):
+    """Yield lists of up to chunksize (index, puzzle) pairs."""
+    numbered = enumerate(puzzles)
+    while True:
+        chunk = list(itertools.islice(numbered, chunksize))
+        if not chunk:
+            return
+        yield chunk
+
+def solve_many(puzzles, n=sudoku._N, boxWidth=sudoku._BOX_WIDTH,
+               workers=None, chunksize=_CHUNKSIZE, ordered=True,
+               engine=sudoku._ENGINE, propagate=False, vectorize=False,
+               maxNodes=None, timeLimit=None):
+    """Solve every puzzle of the iterable puzzles, yielding BatchResults.
+
+    Keyword Arguments:
+
+    workers: the number of worker processes; defaults to the number of
+    CPUs. With 0, puzzles are solved in the calling process.
+
+    chunksize: the number of puzzles handed to a worker at a time.
+
+    ordered: if True, results are yielded in input order; otherwise as
+    soon as each chunk is finished.
+
+    vectorize: if True, each chunk is propagated at once by
+    propagate_batch before any of its puzzles is searched. Chunks of a
+    few thousand puzzles make the most of it.
+
+    engine, propagate, and maxNodes are passed on to analyze, and each
+    puzzle is given timeLimit seconds.
+
+    """
+    options = (n, boxWidth, propagate, vectorize, maxNodes, timeLimit)
+
+    if workers == 0:
+        _init_worker(engine)
+        for chunk in _chunks(puzzles, chunksize):
+            for result in _solve_chunk(chunk, options):
+                yield result
+        return
+
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    pool = multiprocessing.Pool(workers, _init_worker, (engine,))
+
+    # Keep every worker busy without reading the whole input at once.
+    maxInFlight = 2 * workers
+    pending = deque()
+    finished = Queue.Queue()
+
+    solve = _solve_chunk
+    callback = None
+    if not ordered:
+        solve = _solve_chunk_caught
+        callback = finished.put
+
+    try:
+        for chunk in _chunks(puzzles, chunksize):
+            pending.append(pool.apply_async(solve, (chunk, options),
+                                            callback=callback))
+            while len(pending) >= maxInFlight:
+                for result in _collect(pending, finished, ordered):
+                    yield result
+
+        while pending:
+            for result in _collect(pending, finished, ordered):
+                yield result
+
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+def _collect(pending, finished, ordered):
+    """Wait for one chunk to finish and return its results."""
+    if ordered:
+        # get() raises any exception the worker ran into.
+        return pending.popleft().get()
+
+    # Chunks finish in any order; pending only counts those in flight.
+    pending.pop()
+    results = finished.get()
+    if isinstance(results, Exception):
+        raise results
+    return results
+
+############################### Vectorization #################################
+
+# The possible states of a puzzle after propagate_batch.
+CONTRADICTION = -1
+OPEN = 0
+SOLVED = 1
+
+# Maps (n, boxWidth) to the index arrays built by index_tables.
+_INDEX_TABLES = {}
+
+def index_tables(n, boxWidth):
+    """Return the unit_tables of an n x n grid as NumPy index arrays.
+
+    The result is a tuple (units, cellUnits): units[unit] holds the cells
+    of each unit and cellUnits[cell] the three units containing the cell.
+
+    """
+    key = (n, boxWidth)
+    if key not in _INDEX_TABLES:
+        units, cellUnits, peers = sudoku.unit_tables(n, boxWidth)
+        _INDEX_TABLES[key] = (numpy.array(units), numpy.array(cellUnits))
+    return _INDEX_TABLES[key]
+
+def propagate_batch(grids, n=sudoku._N, boxWidth=sudoku._BOX_WIDTH):
+    """Fill in the naked and hidden singles of many grids in lockstep.
+
+    grids is a list of grids, each a list of n**2 integers from 0 to n.
+    The candidates of the whole batch are held in one array of shape
+    (batch, n**2), each entry a bitmask of the digits the cell may still
+    take as in propagate_singles, and every round eliminates singles from
+    all grids still changing with a few reductions over the index_tables.
+
+    Returns a tuple (filled, states): filled is an integer array of shape
+    (batch, n**2) holding the grids with their forced cells filled in,
+    and states[i] is SOLVED, CONTRADICTION, or OPEN if grid i must still
+    be searched. Grids of n > _MAX_VECTOR_N are rejected with a
+    ValueError.
+
+    >>> grids = [[0] * 80 + [9], [5, 5] + [0] * 79]
+    >>> numpy is None or propagate_batch(grids)[1].tolist() == [0, -1]
+    True
+
+    """
+    if n > _MAX_VECTOR_N:
+        raise ValueError('propagate_batch takes grids of n <= %d, not %d'
+                         % (_MAX_VECTOR_N, n))
+    units, cellUnits = index_tables(n, boxWidth)
+    batch = len(grids)
+    full = (1 << n) - 1
+
+    givens = numpy.array(grids, dtype=numpy.int64).reshape(batch, n**2)
+    candidates = numpy.where(givens > 0, 1 << numpy.maximum(givens - 1, 0),
+                             full)
+    states = numpy.zeros(batch, dtype=int)
+
+    # The grids which changed in the last round.
+    active = numpy.arange(batch)
+    while len(active):
+        before = candidates[active]
+        single = before & (before - 1) == 0
+        broken = (before == 0).any(1)
+
+        # Naked singles: a digit left alone in a cell leaves its peers.
+        once, twice = _once_twice(numpy.where(single, before, 0)[:, units])
+        broken |= (twice != 0).any(1)
+        taken = once[:, cellUnits]
+        taken = taken[:, :, 0] | taken[:, :, 1] | taken[:, :, 2]
+        after = numpy.where(single, before, before & ~taken)
+
+        # Hidden singles: a digit left with one cell in a unit takes it.
+        once, twice = _once_twice(after[:, units])
+        broken |= (once != full).any(1)
+        hidden = (once & ~twice)[:, cellUnits]
+        forced = after & (hidden[:, :, 0] | hidden[:, :, 1] | hidden[:, :, 2])
+        after = numpy.where(forced != 0, forced, after)
+
+        changed = (after != before).any(1)
+        candidates[active] = after
+        states[active[broken]] = CONTRADICTION
+        active = active[changed & ~broken]
+
+    single = (candidates & (candidates - 1) == 0) & (candidates != 0)
+    digits = numpy.log2(numpy.where(single, candidates, 1)).astype(int) + 1
+    filled = numpy.where(single, digits, 0)
+    solved = single.all(1) & (states != CONTRADICTION)
+    states[solved] = SOLVED
+    return filled, states
+
+def _once_twice(cells):
+    """Return the digits seen at least once and twice in each unit.
+
+    cells has shape (batch, units, n) and holds the bitmask of each cell
+    of each unit.
+
+    """
+    once = numpy.zeros(cells.shape[:2], dtype=cells.dtype)
+    twice = numpy.zeros(cells.shape[:2], dtype=cells.dtype)
+    for k in xrange(cells.shape[2]):
+        twice |= once & cells[:, :, k]
+        once |= cells[:, :, k]
+    return once, twice
+
+def _read_puzzles(lines, lineNumbers):
+    """Yield the puzzles of lines, skipping blank lines and comments.
+
+    The 1-based line number of each puzzle is recorded in lineNumbers,
+    keyed by the index solve_many gives the puzzle.
+
+    >>> lineNumbers = {}
+    >>> list(_read_puzzles(['# puzzles', '1234', '', '4321'], lineNumbers))
+    ['1234', '4321']
+    >>> lineNumbers
+    {0: 2, 1: 4}
+
+    """
+    index = 0
+    for lineNumber, line in enumerate(lines, 1):
+        if line.strip() and not line.startswith('#'):
+            lineNumbers[index] = lineNumber
+            index += 1
+            yield line.strip()
+
+def main(argv=None):
+    """Solve the puzzles named on the command line."""
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('input', nargs='?', type=argparse.FileType('r'),
+                        default=sys.stdin,
+                        help='file of puzzles, one per line; default stdin')
+    parser.add_argument('-n', type=int, default=sudoku._N)
+    parser.add_argument('--box-width', type=int,
+                        default=sudoku._BOX_WIDTH)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--chunksize', type=int, default=_CHUNKSIZE)
+    parser.add_argument('--unordered', action='store_true',
+                        help='write answers as they finish, each '
+                             'prefixed by its line number in the input')
+    parser.add_argument('--engine', default=sudoku._ENGINE,
+                        choices=sorted(sudoku.ENGINES))
+    parser.add_argument('--propagate', action='store_true')
+    parser.add_argument('--vectorize', action='store_true',
+                        help='propagate each chunk at once with NumPy')
+    parser.add_argument('--max-nodes', type=int, default=None)
+    parser.add_argument('--time-limit', type=float, default=None)
+    parser.add_argument('--verbose', action='store_true',
+                        help='also write the status and milliseconds')
+    args = parser.parse_args(argv)
+
+    # Maps the index of each puzzle in flight to its line of the input.
+    lineNumbers = {}
+    results = solve_many(_read_puzzles(args.input, lineNumbers), args.n, args.box_width, args.workers,
+                         args.chunksize, not args.unordered, args.engine,
+                         args.propagate, args.vectorize, args.max_nodes,
+                         args.time_limit)
+
+    for result in results:
+        fields = [result.answer]
+        lineNumber = lineNumbers.pop(result.index)
+        if args.unordered:
+            fields.insert(0, str(lineNumber))
+        if args.verbose:
+            fields += [result.status, '%.3f' % (1000 * result.elapsed)]
+        sys.stdout.write('\t'.join(fields) + '\n')
+
+if __name__ == "__main__":
+    main()
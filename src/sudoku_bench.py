@@ -0,0 +1,370 @@
+#!/usr/local/bin/python
+# -*- coding: utf-8 -*-
+
+"""Benchmarks of the Sudoku solver over a bundled corpus of puzzles.
+
+The corpus directory next to this module holds one file of puzzles per
+group, one puzzle per line, named after the size of its grids: the
+puzzles of 12x4.txt are 12 x 12 with boxes 4 cells wide, and those of
+9x3-hard.txt are hard 9 x 9 puzzles. Every group is solved with each
+engine in each mode:
+
+build: a new matrix is built for every puzzle, as the CGI script does.
+pool: matrices are borrowed from a warm MatrixPool.
+propagate: as pool, filling in singles with propagate_singles first.
+
+For each case the benchmark reports puzzles per second, the distribution
+of latencies, search nodes per second, the seconds taken to build one
+empty matrix, and the peak memory of the process. Each case runs in a
+process of its own, so that its peak memory is not that of the cases
+before it.
+
+The report is written as JSON. Given the report of an earlier run as a
+baseline, any case whose throughput or latency is worse by more than the
+threshold is listed, and the script exits with status 1:
+
+    python sudoku_bench.py --output baseline.json
+    python sudoku_bench.py --baseline baseline.json --threshold 0.1
+
+Grids too large for the corpus are measured by the capacity report
+instead. For each size and array engine it gives the seconds taken to
+build an empty matrix, the memory the matrix takes, and the time to
+solve a puzzle made by emptying a fraction of the cells of a full grid
+built by formula. The links engine is left out: at 49 x 49 its objects
+alone take several hundred megabytes.
+
+    python sudoku_bench.py --capacity 36x6,49x7,64x8
+
+>>> n, boxWidth, puzzles = load_corpus('9x3-17')
+>>> n, boxWidth, len(puzzles)
+(9, 3, 7)
+>>> run_case('9x3-17', 'array', 'pool')['puzzles']
+7
+>>> run_capacity('12x3', 'array')['solved']
+True
+
+"""
+
+import os
+import sys
+import time
+import json
+import random
+import platform
+import resource
+import multiprocessing
+
+import sudoku
+
+# Directory holding the bundled puzzles.
+CORPUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          'corpus')
+
+# The ways of solving each puzzle, as described above.
+MODES = ('build', 'pool', 'propagate')
+
+# Version of the JSON report.
+_REPORT_VERSION = 1
+
+# Fraction by which a case may be worse than its baseline.
+_THRESHOLD = 0.10
+
+# The sizes of grid, as nxboxWidth, and the engines of the capacity report.
+CAPACITY_SIZES = ('36x6', '49x7', '64x8')
+CAPACITY_ENGINES = ('array', 'array-buckets')
+
+# Fraction of the cells of a capacity puzzle left empty.
+_BLANK = 0.3
+
+def corpus_names():
+    """Return the names of the groups of puzzles in the corpus."""
+    return sorted(name[:-len('.txt')] for name in os.listdir(CORPUS_DIR)
+                  if name.endswith('.txt'))
+
+def load_corpus(name):
+    """Return (n, boxWidth, puzzles) for the group of puzzles name.
+
+    The size is read from the name, such as 16x4 or 9x3-hard.
+
+    """
+    n, boxWidth = name.split('-')[0].split('x')
+    with open(os.path.join(CORPUS_DIR, name + '.txt')) as f:
+        puzzles = [line.strip() for line in f
+                   if line.strip() and not line.startswith('#')]
+    return int(n), int(boxWidth), puzzles
+
+def percentile(values, fraction):
+    """Return the value below which fraction of the sorted values fall.
+
+    >>> percentile([3, 1, 2, 4], 0.5), percentile([3, 1, 2, 4], 1)
+    (2, 4)
+
+    """
+    values = sorted(values)
+    rank = max(int(round(fraction * len(values))) - 1, 0)
+    return values[rank]
+
+def run_case(name, engine, mode, repeat=1):
+    """Solve the group name repeat times; return the case's metrics."""
+    n, boxWidth, puzzles = load_corpus(name)
+    memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    started = time.time()
+    sudoku.ENGINES[engine]("0" * n**2, n, boxWidth)
+    setup = time.time() - started
+
+    pool = None
+    if mode != 'build':
+        pool = sudoku.MatrixPool(engine)
+        pool.warm([(n, boxWidth)])
+    propagate = mode == 'propagate'
+
+    latencies = []
+    nodes = 0
+    for i in xrange(repeat):
+        for puzzle in puzzles:
+            started = time.time()
+            result = sudoku.analyze(puzzle, n, boxWidth, engine=engine,
+                                    pool=pool, propagate=propagate)
+            latencies.append(time.time() - started)
+            nodes += result.nodes
+
+    seconds = sum(latencies)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {
+        'puzzles': len(latencies),
+        'seconds': seconds,
+        'puzzlesPerSecond': len(latencies) / seconds,
+        'nodes': nodes,
+        'nodesPerSecond': nodes / seconds,
+        'setupSeconds': setup,
+        'latency': {
+            'mean': 1000 * seconds / len(latencies),
+            'p50': 1000 * percentile(latencies, 0.50),
+            'p90': 1000 * percentile(latencies, 0.90),
+            'p99': 1000 * percentile(latencies, 0.99),
+            'max': 1000 * max(latencies),
+        },
+        'peakMemoryKB': peak,
+        'memoryGrowthKB': peak - memory,
+    }
+
+def pattern_grid(n, boxWidth):
+    """Return a full n x n grid as a list of integers, built by formula.
+
+    >>> sudoku.format_grid(pattern_grid(4, 2), 4)
+    '1234341223414123'
+
+    """
+    boxHeight = n // boxWidth
+    return [((row % boxHeight) * boxWidth + row // boxHeight + col) % n + 1
+            for row in xrange(n) for col in xrange(n)]
+
+def capacity_puzzle(n, boxWidth, blank=_BLANK, seed=0):
+    """Return a puzzle with the fraction blank of the pattern grid emptied.
+
+    Its digits are relabelled at random, so that the search does not
+    meet them in order. The puzzle is a string as format_grid writes it.
+
+    """
+    rng = random.Random(seed)
+    labels = range(1, n + 1)
+    rng.shuffle(labels)
+    cells = [labels[digit - 1] if rng.random() >= blank else 0
+             for digit in pattern_grid(n, boxWidth)]
+    return sudoku.format_grid(cells, n)
+
+def run_capacity(size, engine):
+    """Build and solve a grid of size, such as 64x8; return its metrics."""
+    n, boxWidth = [int(x) for x in size.split('x')]
+    puzzle = capacity_puzzle(n, boxWidth)
+    memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    started = time.time()
+    pool = sudoku.MatrixPool(engine)
+    pool.warm([(n, boxWidth)])
+    setup = time.time() - started
+    built = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    started = time.time()
+    result = sudoku.analyze(puzzle, n, boxWidth, numSols=1, pool=pool)
+    seconds = time.time() - started
+
+    return {
+        'setupSeconds': setup,
+        'matrixKB': built - memory,
+        'solveSeconds': seconds,
+        'nodes': result.nodes,
+        'nodesPerSecond': result.nodes / seconds,
+        'solved': result.solution is not None,
+        'peakMemoryKB': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+def _run(function, args, isolate):
+    """Return function(*args), in a fresh process if isolate is True."""
+    if not isolate:
+        return function(*args)
+    pool = multiprocessing.Pool(1)
+    try:
+        return pool.apply(function, args)
+    finally:
+        pool.terminate()
+        pool.join()
+
+def benchmark(names=None, engines=None, modes=MODES, repeat=1,
+              isolate=True, log=None):
+    """Run every case and return the report as a dict.
+
+    Keyword Arguments:
+
+    names, engines, modes: the groups of the corpus, the engines, and the
+    modes to run; all of them by default.
+
+    repeat: the number of times each group is solved.
+
+    isolate: if True, each case runs in a fresh process.
+
+    log: an optional file to which each case is summarized as it ends.
+
+    """
+    if names is None:
+        names = corpus_names()
+    if engines is None:
+        engines = sorted(sudoku.ENGINES)
+
+    cases = {}
+    for name in names:
+        for engine in engines:
+            for mode in modes:
+                metrics = _run(run_case, (name, engine, mode, repeat),
+                               isolate)
+
+                key = '%s/%s/%s' % (name, engine, mode)
+                cases[key] = metrics
+                if log is not None:
+                    log.write('%-32s %9.1f puzzles/s %9.2f ms p90 '
+                              '%9.0f nodes/s %8d KB\n' %
+                              (key, metrics['puzzlesPerSecond'],
+                               metrics['latency']['p90'],
+                               metrics['nodesPerSecond'],
+                               metrics['peakMemoryKB']))
+
+    return {
+        'version': _REPORT_VERSION,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'repeat': repeat,
+        'cases': cases,
+    }
+
+def capacity(sizes=CAPACITY_SIZES, engines=CAPACITY_ENGINES, isolate=True,
+             log=None):
+    """Return the capacity report of each size and engine, keyed size/engine.
+
+    The arguments are those of benchmark.
+
+    """
+    cases = {}
+    for size in sizes:
+        for engine in engines:
+            metrics = _run(run_capacity, (size, engine), isolate)
+            key = '%s/%s' % (size, engine)
+            cases[key] = metrics
+            if log is not None:
+                log.write('%-32s %8.2f s setup %8d KB matrix %8.2f s solve '
+                          '%9.0f nodes/s\n' %
+                          (key, metrics['setupSeconds'],
+                           metrics['matrixKB'], metrics['solveSeconds'],
+                           metrics['nodesPerSecond']))
+    return cases
+
+def compare(report, baseline, threshold=_THRESHOLD):
+    """Return the cases of report which regressed against baseline.
+
+    A case regresses if its puzzles per second fell, or its 90th
+    percentile latency rose, by more than the fraction threshold. Cases
+    missing from either report are ignored.
+
+    >>> old = {'cases': {'a': {'puzzlesPerSecond': 100.0,
+    ...                        'latency': {'p90': 10.0}}}}
+    >>> new = {'cases': {'a': {'puzzlesPerSecond': 80.0,
+    ...                        'latency': {'p90': 10.5}}}}
+    >>> compare(new, old)
+    ['a: puzzlesPerSecond fell from 100.0 to 80.0']
+
+    """
+    regressions = []
+    for key in sorted(report['cases']):
+        if key not in baseline['cases']:
+            continue
+        new = report['cases'][key]
+        old = baseline['cases'][key]
+
+        rate, oldRate = new['puzzlesPerSecond'], old['puzzlesPerSecond']
+        if rate < (1 - threshold) * oldRate:
+            regressions.append('%s: puzzlesPerSecond fell from %.1f to %.1f'
+                               % (key, oldRate, rate))
+        p90, oldP90 = new['latency']['p90'], old['latency']['p90']
+        if p90 > (1 + threshold) * oldP90:
+            regressions.append('%s: p90 latency rose from %.2f to %.2f ms'
+                               % (key, oldP90, p90))
+    return regressions
+
+def main(argv=None):
+    """Run the benchmarks named on the command line."""
+    import argparse
+
+    def names(s):
+        return [name for name in s.split(',') if name]
+
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--corpus', type=names, default=None,
+                        help='groups of puzzles to run, e.g. 9x3-hard,16x4')
+    parser.add_argument('--engines', type=names, default=None)
+    parser.add_argument('--modes', type=names, default=list(MODES))
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--output', default=None,
+                        help='file to write the JSON report to; default '
+                             'stdout')
+    parser.add_argument('--baseline', default=None,
+                        help='JSON report to compare against')
+    parser.add_argument('--threshold', type=float, default=_THRESHOLD,
+                        help='fraction by which a case may be worse than '
+                             'the baseline')
+    parser.add_argument('--no-isolate', action='store_true',
+                        help='run every case in this process')
+    parser.add_argument('--capacity', type=names, default=None,
+                        help='sizes to report build time and memory for, '
+                             'e.g. 36x6,64x8; the corpus is skipped unless '
+                             '--corpus is given')
+    args = parser.parse_args(argv)
+
+    corpus = args.corpus
+    if args.capacity is not None and corpus is None:
+        corpus = []
+    report = benchmark(corpus, args.engines, args.modes, args.repeat,
+                       not args.no_isolate, sys.stderr)
+    if args.capacity is not None:
+        report['capacity'] = capacity(args.capacity,
+                                      args.engines or CAPACITY_ENGINES,
+                                      not args.no_isolate, sys.stderr)
+
+    text = json.dumps(report, indent=2, sort_keys=True,
+                      separators=(',', ': ')) + '\n'
+    if args.output is None:
+        sys.stdout.write(text)
+    else:
+        with open(args.output, 'w') as f:
+            f.write(text)
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.threshold)
+        for regression in regressions:
+            sys.stderr.write(regression + '\n')
+        if regressions:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,327 @@
+#!/usr/local/bin/python
+# -*- coding: utf-8 -*-
+
+"""Generation of Sudoku puzzles with exactly one solution.
+
+A PuzzleGenerator fills an empty matrix with a random full grid, by a
+search which tries the Candidates of each Constraint in random order. It
+then removes clues from that grid, a group of cells at a time so that
+the clues keep the chosen symmetry, and checks after each removal that
+the puzzle still has a single solution. A removal which allows a second
+solution is undone.
+
+The clues live on one matrix for as long as the generator does: a clue
+is removed with remove_filled_cell and put back with add_filled_cell,
+and each check is a CountingSearch which leaves the matrix as it found
+it. No matrix is built for any puzzle after the first.
+
+Removal stops once the puzzle is down to the target number of clues or
+its time budget is spent; either way, every puzzle returned has been
+checked to be unique. generate_many spreads puzzles across processes:
+
+    python sudoku_generate.py --count 1000 -n 16 --box-width 4 --workers 8
+
+>>> generator = PuzzleGenerator(seed=1)
+>>> puzzle = generator.generate()
+>>> sudoku.is_unique(puzzle)
+True
+>>> filled = [digit != '0' for digit in puzzle]
+>>> filled == filled[::-1]
+True
+>>> len(list(generate_many(2, 4, 2, workers=0, seed=1)))
+2
+
+"""
+
+import sys
+import time
+import random
+import multiprocessing
+
+import sudoku
+
+# The clue patterns a generator can keep.
+SYMMETRIES = ('none', 'rotate180', 'rotate90', 'mirror', 'diagonal')
+_SYMMETRY = 'rotate180'
+
+# Search nodes to spend on a random full grid before starting over.
+_GRID_NODES = 10000
+
+# Number of seeds handed to a worker at a time.
+_CHUNKSIZE = 4
+
+# The PuzzleGenerators of a worker process, keyed by their arguments.
+_WORKER_GENERATORS = {}
+
+def orbit(row, col, n, symmetry=_SYMMETRY):
+    """Return the cells which symmetry fills or empties with (row, col).
+
+    >>> orbit(0, 1, 9, 'rotate180')
+    [(0, 1), (8, 7)]
+    >>> orbit(0, 1, 9, 'rotate90')
+    [(0, 1), (1, 8), (7, 0), (8, 7)]
+
+    """
+    last = n - 1
+    if symmetry == 'none':
+        cells = [(row, col)]
+    elif symmetry == 'rotate180':
+        cells = [(row, col), (last - row, last - col)]
+    elif symmetry == 'rotate90':
+        cells = [(row, col), (col, last - row), (last - row, last - col),
+                 (last - col, row)]
+    elif symmetry == 'mirror':
+        cells = [(row, col), (row, last - col)]
+    elif symmetry == 'diagonal':
+        cells = [(row, col), (col, row)]
+    else:
+        raise ValueError('unknown symmetry %r' % symmetry)
+    return sorted(set(cells))
+
+class PuzzleGenerator:
+    """Generates unique puzzles of one size on a single live matrix."""
+
+    def __init__(self, n=sudoku._N, boxWidth=sudoku._BOX_WIDTH,
+                 symmetry=_SYMMETRY, engine=sudoku._ENGINE, seed=None):
+        """Build the matrix the puzzles are generated on.
+
+        Keyword Arguments:
+
+        n, boxWidth: the size of the grids.
+
+        symmetry: one of SYMMETRIES; the clues of every puzzle are left
+        unchanged by it.
+
+        engine: the name of the engine in ENGINES to build the matrix with.
+
+        seed: the seed of the generator's random numbers.
+
+        """
+        if symmetry not in SYMMETRIES:
+            raise ValueError('unknown symmetry %r' % symmetry)
+        self.n = n
+        self.boxWidth = boxWidth
+        self.symmetry = symmetry
+        self.random = random.Random(seed)
+        self.matrix = sudoku.ENGINES[engine]("0" * n**2, n, boxWidth)
+
+        # The solution of the last puzzle generated.
+        self.solution = None
+
+        # Each group of cells emptied together, listed once.
+        self.orbits = []
+        seen = set()
+        for row in xrange(n):
+            for col in xrange(n):
+                if (row, col) not in seen:
+                    cells = orbit(row, col, n, symmetry)
+                    seen.update(cells)
+                    self.orbits.append(cells)
+
+    def full_grid(self):
+        """Return a random full grid."""
+        matrix = self.matrix
+        while matrix.choices != []:
+            matrix.backtrack()
+
+        while True:
+            search = sudoku.Search(_Shuffled(matrix, self.random), 1)
+            solutions = search.run(_GRID_NODES)
+            if solutions:
+                return solutions[0]
+
+    def generate(self, targetClues=0, timeLimit=None, maxNodes=None):
+        """Return a new puzzle with a unique solution.
+
+        Keyword Arguments:
+
+        targetClues: the number of clues below which no more are removed.
+
+        timeLimit: the seconds to spend removing clues. The puzzle is
+        returned with the clues it has left when they run out.
+
+        maxNodes: the search nodes to spend checking each removal; a
+        removal whose check runs out of nodes is undone.
+
+        """
+        deadline = None
+        if timeLimit is not None:
+            deadline = time.time() + timeLimit
+
+        n = self.n
+        matrix = self.matrix
+        solution = self.full_grid()
+        digits = sudoku.grid_cells(solution, n)
+
+        # The clues are filled in in the reverse of the order in which
+        # they are tried, so remove_filled_cell only has to take out and
+        # put back the clues kept since.
+        orbits = list(self.orbits)
+        self.random.shuffle(orbits)
+        for cells in reversed(orbits):
+            for row, col in cells:
+                matrix.add_filled_cell(row, col, digits[row * n + col])
+
+        clues = n**2
+        for cells in orbits:
+            if deadline is not None and time.time() >= deadline:
+                break
+            if clues - len(cells) < targetClues:
+                continue
+
+            for row, col in cells:
+                matrix.remove_filled_cell(row, col)
+
+            search = sudoku.CountingSearch(matrix, 2)
+            search.run(maxNodes, deadline)
+            if search.count == 1 and not search.exhausted:
+                clues -= len(cells)
+            else:
+                for row, col in cells:
+                    matrix.add_filled_cell(row, col, digits[row * n + col])
+
+        puzzle = matrix.get_string()
+        while matrix.choices != []:
+            matrix.backtrack()
+        self.solution = solution
+        return puzzle
+
+class _Shuffled:
+    """A matrix whose branches are tried in random order."""
+
+    def __init__(self, matrix, random):
+        """Wrap matrix, shuffling its branches with random."""
+        self.matrix = matrix
+        self.random = random
+        self.n = matrix.n
+        self.numSols = matrix.numSols
+        self.choices = matrix.choices
+
+    def is_solved(self):
+        """Return True if the matrix is solved."""
+        return self.matrix.is_solved()
+
+    def chosen_constraint(self):
+        """Return the matrix's Constraint to branch on."""
+        return self.matrix.chosen_constraint()
+
+    def constraint_size(self, constraint):
+        """Return the number of Nodes beneath constraint."""
+        return self.matrix.constraint_size(constraint)
+
+    def branches(self, constraint):
+        """Return the Candidates intersecting constraint, shuffled."""
+        branches = self.matrix.branches(constraint)
+        self.random.shuffle(branches)
+        return branches
+
+    def choose(self, index):
+        """Choose Candidate index."""
+        self.matrix.choose(index)
+
+    def backtrack(self):
+        """Undo the last choice."""
+        self.matrix.backtrack()
+
+    def get_string(self, choices=None):
+        """Render the matrix's partial solution."""
+        return self.matrix.get_string(choices)
+
+def generate_puzzle(n=sudoku._N, boxWidth=sudoku._BOX_WIDTH,
+                    symmetry=_SYMMETRY, targetClues=0, timeLimit=None,
+                    engine=sudoku._ENGINE, seed=None, maxNodes=None):
+    """Return one new puzzle with a unique solution.
+
+    The arguments are those of PuzzleGenerator and its generate method.
+
+    """
+    generator = PuzzleGenerator(n, boxWidth, symmetry, engine, seed)
+    return generator.generate(targetClues, timeLimit, maxNodes)
+
+def _generate(args):
+    """Generate the puzzle of one seed in a worker process."""
+    seed, options = args
+    n, boxWidth, symmetry, engine, targetClues, timeLimit, maxNodes = options
+
+    key = (n, boxWidth, symmetry, engine)
+    generator = _WORKER_GENERATORS.get(key)
+    if generator is None:
+        generator = PuzzleGenerator(n, boxWidth, symmetry, engine)
+        _WORKER_GENERATORS[key] = generator
+    generator.random.seed(seed)
+    return generator.generate(targetClues, timeLimit, maxNodes)
+
+def generate_many(count, n=sudoku._N, boxWidth=sudoku._BOX_WIDTH,
+                  symmetry=_SYMMETRY, targetClues=0, timeLimit=None,
+                  workers=None, engine=sudoku._ENGINE, seed=None,
+                  maxNodes=None):
+    """Yield count new puzzles with unique solutions.
+
+    Keyword Arguments:
+
+    workers: the number of worker processes; defaults to the number of
+    CPUs. With 0, puzzles are generated in the calling process.
+
+    seed: the seed from which the seed of each puzzle is drawn. The same
+    seed yields the same puzzles, in the same order, whatever the number
+    of workers.
+
+    The other arguments are those of generate_puzzle.
+
+    """
+    seeds = random.Random(seed)
+    tasks = ((seeds.getrandbits(64),
+              (n, boxWidth, symmetry, engine, targetClues, timeLimit,
+               maxNodes))
+             for i in xrange(count))
+
+    if workers == 0:
+        for task in tasks:
+            yield _generate(task)
+        return
+
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    pool = multiprocessing.Pool(workers)
+    try:
+        for puzzle in pool.imap(_generate, tasks, _CHUNKSIZE):
+            yield puzzle
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+def main(argv=None):
+    """Print the puzzles asked for on the command line, one per line."""
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--count', type=int, default=1)
+    parser.add_argument('-n', type=int, default=sudoku._N)
+    parser.add_argument('--box-width', type=int,
+                        default=sudoku._BOX_WIDTH)
+    parser.add_argument('--symmetry', default=_SYMMETRY,
+                        choices=SYMMETRIES)
+    parser.add_argument('--target-clues', type=int, default=0,
+                        help='stop removing clues at this many')
+    parser.add_argument('--time-limit', type=float, default=None,
+                        help='seconds to spend removing clues per puzzle')
+    parser.add_argument('--max-nodes', type=int, default=None,
+                        help='search nodes to spend checking each removal')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--engine', default=sudoku._ENGINE,
+                        choices=sorted(sudoku.ENGINES))
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args(argv)
+
+    started = time.time()
+    for puzzle in generate_many(args.count, args.n, args.box_width,
+                                args.symmetry, args.target_clues,
+                                args.time_limit, args.workers, args.engine,
+                                args.seed, args.max_nodes):
+        print puzzle
+    sys.stderr.write('%d puzzles, %.3fs\n' %
+                     (args.count, time.time() - started))
+
+if __name__ == "__main__":
+    main()
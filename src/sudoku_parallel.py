@@ -0,0 +1,413 @@
+#!/usr/local/bin/python
+# -*- coding: utf-8 -*-
+
+"""Parallel search of a single Sudoku grid across processes.
+
+A single grid is otherwise searched on one core, however long that
+takes. solve_parallel instead expands the search tree down to a frontier
+depth, choosing Constraints with chosen_constraint just as the
+sequential search does, and hands the subtrees below the frontier to
+worker processes. A worker which runs out of subtrees while others are
+still busy steals work from them: each busy worker, between slices of
+its search, splits off the untried branches nearest the root of its own
+search and queues them as new subtrees.
+
+The workers are forked once the matrix has been built, so none of them
+builds it again. The number of solutions found is kept in shared memory:
+once numSols have been found, or the node or time budget runs out, every
+worker abandons its search.
+
+Solutions are found in no particular order, but their number, and so
+the status reported by analyze_parallel, is that of a sequential search.
+
+    python sudoku_parallel.py GRID -n 16 --box-width 4 --workers 16
+
+>>> len(solve_parallel('0' * 80 + '9', numSols=5, workers=2))
+5
+>>> analyze_parallel('0' * 80 + '9', workers=2).status
+'multiple'
+>>> analyze_parallel('55' + '0' * 79, workers=2).status
+'none'
+
+"""
+
+import sys
+import time
+import multiprocessing
+import Queue
+
+import sudoku
+
+# Depth of the search tree expanded before the workers start.
+_DEPTH = 3
+
+# Number of search nodes a worker visits between checks for idle
+# workers, the budget, and the numSols limit.
+_SPLIT_NODES = 256
+
+# Seconds to wait on a queue before checking for the end of the search.
+_POLL = 0.05
+
+def solve_parallel(L, n=sudoku._N, boxWidth=sudoku._BOX_WIDTH,
+                   numSols=sudoku._NUMSOLS, engine=sudoku._ENGINE,
+                   workers=None, depth=_DEPTH, maxNodes=None,
+                   deadline=None):
+    """Return up to numSols solutions of the grid L, searched in parallel.
+
+    Keyword Arguments:
+
+    workers: the number of worker processes; defaults to the number of
+    CPUs.
+
+    depth: the depth of the search tree expanded before handing its
+    subtrees to the workers.
+
+    n, boxWidth, numSols, engine, maxNodes, and deadline are as for
+    find_solutions. The node budget is checked every few hundred nodes by
+    each worker, so the search may overshoot maxNodes slightly.
+
+    """
+    matrix = sudoku.ENGINES[engine](L, n, boxWidth, numSols)
+    return ParallelSearch(matrix, numSols, workers, depth).run(maxNodes,
+                                                               deadline)
+
+def analyze_parallel(L, n=sudoku._N, boxWidth=sudoku._BOX_WIDTH,
+                     numSols=sudoku._NUMSOLS, engine=sudoku._ENGINE,
+                     workers=None, depth=_DEPTH, maxNodes=None,
+                     deadline=None):
+    """Search the grid L in parallel and return a SolveResult.
+
+    The arguments are those of solve_parallel; the result is that of
+    analyze.
+
+    """
+    started = time.time()
+    result = sudoku.SolveResult(numSols)
+    matrix = sudoku.ENGINES[engine](L, n, boxWidth, numSols)
+    search = ParallelSearch(matrix, numSols, workers, depth)
+    solutions = search.run(maxNodes, deadline)
+
+    solution = None
+    if len(solutions) == 1:
+        solution = solutions[0]
+    result.nodes = search.nodes
+    return result.finish(len(solutions), solution, search.exhausted,
+                         started)
+
+class ParallelSearch:
+    """A search of one matrix split between several worker processes.
+
+    >>> search = ParallelSearch(sudoku.SudokuMatrix('0' * 80 + '9'),
+    ...                         numSols=3, workers=2)
+    >>> len(search.run()), search.exhausted
+    (3, False)
+
+    """
+    def __init__(self, matrix, numSols=None, workers=None, depth=_DEPTH):
+        """Prepare to search matrix for numSols solutions with workers."""
+        self.matrix = matrix
+        if numSols is None:
+            numSols = matrix.numSols
+        self.numSols = numSols
+        if workers is None:
+            workers = multiprocessing.cpu_count()
+        self.workers = workers
+        self.depth = depth
+
+        self.solutions = []
+        self.nodes = 0
+        self.exhausted = False
+
+    def run(self, maxNodes=None, deadline=None):
+        """Search to the end and return the solutions found."""
+        prefixes = []
+        self.nodes = self.expand(self.depth, [], prefixes)
+        if len(self.solutions) >= self.numSols:
+            del self.solutions[int(self.numSols):]
+            return self.solutions
+        if not prefixes:
+            return self.solutions
+
+        shared = _Shared(len(self.solutions), self.nodes)
+        for prefix in prefixes:
+            shared.put(prefix)
+
+        # Forked workers inherit the matrix as it stands, with only the
+        # givens chosen.
+        processes = []
+        for i in xrange(self.workers):
+            process = multiprocessing.Process(
+                target=_work, args=(self.matrix, shared, self.numSols,
+                                    maxNodes, deadline))
+            process.daemon = True
+            process.start()
+            processes.append(process)
+
+        # Every worker sends its solutions, then None once it stops.
+        running = len(processes)
+        while running:
+            try:
+                solution = shared.results.get(timeout=_POLL)
+            except Queue.Empty:
+                if not [p for p in processes if p.is_alive()]:
+                    running = self.drain(shared.results, running)
+                    if running:
+                        # A worker was killed before it could say so.
+                        shared.exhausted.value = 1
+                    break
+                continue
+            if solution is None:
+                running -= 1
+            else:
+                self.solutions.append(solution)
+
+        for process in processes:
+            process.join()
+        shared.close()
+
+        self.nodes = shared.nodes.value
+        self.exhausted = bool(shared.exhausted.value)
+        return self.solutions
+
+    def drain(self, results, running):
+        """Collect what exited workers left in results.
+
+        Returns the number of workers still to send None.
+
+        """
+        while running:
+            try:
+                solution = results.get_nowait()
+            except Queue.Empty:
+                break
+            if solution is None:
+                running -= 1
+            else:
+                self.solutions.append(solution)
+        return running
+
+    def expand(self, depth, path, prefixes):
+        """Search the matrix down to depth, collecting the frontier.
+
+        The path of Candidates chosen to reach each node at depth is
+        appended to prefixes; solutions found above it are recorded.
+        Returns the number of search nodes visited.
+
+        """
+        matrix = self.matrix
+        if matrix.is_solved():
+            self.solutions.append(matrix.get_string())
+            return 1
+        if depth == 0:
+            # The worker searching this subtree visits its root.
+            prefixes.append(list(path))
+            return 0
+
+        nodes = 1
+        constraint = matrix.chosen_constraint()
+        for index in matrix.branches(constraint):
+            matrix.choose(index)
+            path.append(index)
+            nodes += self.expand(depth - 1, path, prefixes)
+            path.pop()
+            matrix.backtrack()
+        return nodes
+
+class _Shared:
+    """The queues and counters shared by the workers of a ParallelSearch."""
+
+    def __init__(self, found, nodes):
+        """Start from found solutions and nodes already visited."""
+        self.tasks = multiprocessing.Queue()
+        self.results = multiprocessing.Queue()
+
+        self.found = multiprocessing.Value('i', found)
+        self.nodes = multiprocessing.Value('l', nodes)
+
+        # Subtrees queued or being searched; the search is over when no
+        # subtree is left.
+        self.outstanding = multiprocessing.Value('i', 0)
+        self.queued = multiprocessing.Value('i', 0)
+
+        # Workers waiting for a subtree.
+        self.idle = multiprocessing.Value('i', 0)
+
+        self.stop = multiprocessing.Value('b', 0)
+        self.exhausted = multiprocessing.Value('b', 0)
+
+    def put(self, prefix):
+        """Queue the subtree reached by choosing the Candidates of prefix."""
+        # Counted before it is queued, so outstanding never reaches zero
+        # while the subtree is in transit.
+        with self.outstanding.get_lock():
+            self.outstanding.value += 1
+        with self.queued.get_lock():
+            self.queued.value += 1
+        self.tasks.put(prefix)
+
+    def take(self):
+        """Return a queued subtree, or None if none arrives in time."""
+        with self.idle.get_lock():
+            self.idle.value += 1
+        try:
+            prefix = self.tasks.get(timeout=_POLL)
+        except Queue.Empty:
+            return None
+        finally:
+            with self.idle.get_lock():
+                self.idle.value -= 1
+
+        with self.queued.get_lock():
+            self.queued.value -= 1
+        return prefix
+
+    def close(self):
+        """Discard the subtrees left once every worker has exited.
+
+        Subtrees still in the queue's feeder would otherwise be written
+        to a pipe nobody reads, once the queue is collected.
+
+        """
+        while True:
+            try:
+                self.tasks.get(timeout=_POLL)
+            except Queue.Empty:
+                break
+        self.tasks.close()
+        self.tasks.cancel_join_thread()
+
+    def done(self):
+        """Record that a subtree has been searched."""
+        with self.outstanding.get_lock():
+            self.outstanding.value -= 1
+
+    def wanted(self):
+        """Return True if idle workers are waiting for more subtrees."""
+        return self.idle.value > self.queued.value
+
+    def count(self, nodes, maxNodes):
+        """Add nodes to the total; return False once maxNodes is spent."""
+        with self.nodes.get_lock():
+            self.nodes.value += nodes
+            return maxNodes is None or self.nodes.value < maxNodes
+
+    def exhaust(self):
+        """Stop every worker because the budget ran out."""
+        self.exhausted.value = 1
+        self.stop.value = 1
+
+class _SubtreeSearch(sudoku.Search):
+    """The Search of one subtree by a worker of a ParallelSearch."""
+
+    def __init__(self, matrix, shared, numSols, prefix):
+        """Prepare to search the subtree below prefix."""
+        sudoku.Search.__init__(self, matrix, numSols)
+        self.shared = shared
+        self.limit = numSols
+        self.prefix = prefix
+
+    def solution_found(self):
+        """Send the solution held by the matrix, if still wanted."""
+        found = self.shared.found
+        with found.get_lock():
+            if found.value >= self.limit:
+                self.numSols = 0
+                return
+            found.value += 1
+            self.numSols = self.limit - found.value
+            if self.numSols <= 0:
+                self.shared.stop.value = 1
+        self.shared.results.put(self.matrix.get_string())
+
+    def split(self):
+        """Queue the untried branches nearest the root as new subtrees.
+
+        Returns True if there were any.
+
+        """
+        path = list(self.prefix)
+        for frame in self.stack:
+            branches, tried = frame
+            if tried < len(branches):
+                for index in branches[tried:]:
+                    self.shared.put(path + [index])
+                frame[0] = branches[:tried]
+                return True
+            path.append(branches[tried - 1])
+        return False
+
+def _work(matrix, shared, numSols, maxNodes, deadline):
+    """Search queued subtrees of matrix until none is left."""
+    # Subtrees left in the queue when the search stops are never read.
+    shared.tasks.cancel_join_thread()
+    try:
+        while not shared.stop.value:
+            prefix = shared.take()
+            if prefix is None:
+                if shared.outstanding.value == 0:
+                    break
+                continue
+
+            for index in prefix:
+                matrix.choose(index)
+            search = _SubtreeSearch(matrix, shared, numSols, prefix)
+            counted = 0
+            while True:
+                finished = search.step(_SPLIT_NODES)
+                inBudget = shared.count(search.nodes - counted, maxNodes)
+                counted = search.nodes
+                if finished:
+                    break
+                if not inBudget or (deadline is not None and
+                                    time.time() >= deadline):
+                    shared.exhaust()
+                if shared.stop.value:
+                    search.abandon()
+                    break
+                if shared.wanted():
+                    search.split()
+            for index in prefix:
+                matrix.backtrack()
+            shared.done()
+    except Exception:
+        # The subtree is lost, so the count can no longer be trusted.
+        shared.exhaust()
+        raise
+    finally:
+        shared.results.put(None)
+
+def main(argv=None):
+    """Search the grid given on the command line."""
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('grid')
+    parser.add_argument('-n', type=int, default=sudoku._N)
+    parser.add_argument('--box-width', type=int,
+                        default=sudoku._BOX_WIDTH)
+    parser.add_argument('--num-sols', type=float, default=sudoku._NUMSOLS,
+                        help="solutions to find; 'inf' finds them all")
+    parser.add_argument('--engine', default=sudoku._ENGINE,
+                        choices=sorted(sudoku.ENGINES))
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--depth', type=int, default=_DEPTH)
+    parser.add_argument('--max-nodes', type=int, default=None)
+    parser.add_argument('--time-limit', type=float, default=None)
+    args = parser.parse_args(argv)
+
+    deadline = None
+    if args.time_limit is not None:
+        deadline = time.time() + args.time_limit
+
+    started = time.time()
+    matrix = sudoku.ENGINES[args.engine](args.grid, args.n, args.box_width)
+    search = ParallelSearch(matrix, args.num_sols, args.workers, args.depth)
+    for solution in search.run(args.max_nodes, deadline):
+        print solution
+    sys.stderr.write('%d solutions, %d nodes, %.3fs%s\n' %
+                     (len(search.solutions), search.nodes,
+                      time.time() - started,
+                      search.exhausted and ' (gave up)' or ''))
+
+if __name__ == "__main__":
+    main()
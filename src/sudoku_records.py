@@ -0,0 +1,371 @@
+#!/usr/local/bin/python
+# -*- coding: utf-8 -*-
+
+"""A compact binary format for large collections of Sudoku puzzles.
+
+A record file starts with an 8 byte header: the magic string SDKR, the
+version of the format, n, boxWidth, and the number of bits per cell.
+Fixed-width records follow, one per puzzle. Each cell holds its digit, 0
+for an empty cell, in a byte, or in a nibble when n <= 15; two cells
+share each byte, the first in the high nibble. A 9 x 9 puzzle thus takes
+41 bytes rather than the 82 of a line of text.
+
+RecordFile memory-maps a record file, so that a puzzle is read only
+when it is asked for, by its index. With a byte per cell, each puzzle is
+a buffer into the map which set_grid takes as it is:
+
+    python sudoku_records.py pack puzzles.txt puzzles.sdr
+    python sudoku_records.py solve puzzles.sdr > solutions.txt
+
+>>> import os, tempfile
+>>> path = os.path.join(tempfile.mkdtemp(), 'puzzles.sdr')
+>>> write_records(path, ['0' * 80 + '9', '12' + '0' * 79])
+2
+>>> records = RecordFile(path)
+>>> len(records), os.path.getsize(path)
+(2, 90)
+>>> records.puzzle(1) == '12' + '0' * 79
+True
+>>> matrix = sudoku.SudokuMatrix()
+>>> matrix.set_grid(records[-1])
+>>> matrix.get_string() == records.puzzle(1)
+True
+>>> records.close()
+
+"""
+
+import sys
+import mmap
+import struct
+import itertools
+
+import sudoku
+
+# The header: magic, version, n, boxWidth, and bits per cell.
+_MAGIC = 'SDKR'
+_VERSION = 1
+_HEADER = struct.Struct('<4sBBBB')
+
+# The largest n whose digits fit in a nibble.
+_NIBBLE_N = 15
+
+# Maps each character of a grid string to the value of its cell; a
+# character which is not a digit maps to 255, which no n allows.
+_CELL_VALUES = bytearray([255] * 256)
+_CELL_VALUES[ord('0')] = 0
+for _value, _digit in enumerate(sudoku._DIGITS):
+    _CELL_VALUES[ord(_digit)] = _value + 1
+    _CELL_VALUES[ord(_digit.lower())] = _value + 1
+_CELL_VALUES = str(_CELL_VALUES)
+
+# Maps the value of a cell back to its character.
+_CELL_DIGITS = str(bytearray('0' + sudoku._DIGITS +
+                             '?' * (256 - 1 - len(sudoku._DIGITS))))
+
+# The two cells held by each value of a byte of nibbles.
+_NIBBLES = [chr(byte >> 4) + chr(byte & 15) for byte in xrange(256)]
+
+def cell_bits(n):
+    """Return the bits per cell used for n x n grids by default."""
+    if n <= _NIBBLE_N:
+        return 4
+    return 8
+
+def record_size(n, bits=None):
+    """Return the bytes taken by each record of an n x n grid.
+
+    >>> record_size(9), record_size(16)
+    (41, 256)
+
+    """
+    if bits is None:
+        bits = cell_bits(n)
+    return (n**2 * bits + 7) // 8
+
+def to_cells(puzzle, n):
+    """Return the cells of puzzle as a bytearray of n**2 values.
+
+    puzzle is a string in base n + 1 or in the delimited form of
+    format_grid, as find_solutions takes it, or a sequence of integers.
+    Raises ValueError for any other puzzle.
+
+    >>> to_cells([0, 10, 0, 0], 2)
+    Traceback (most recent call last):
+        ...
+    ValueError: puzzle of 4 cells is not a valid 2 x 2 grid
+    >>> list(to_cells('1a0', 10))
+    Traceback (most recent call last):
+        ...
+    ValueError: puzzle of 3 cells is not a valid 10 x 10 grid
+    >>> list(to_cells('1020', 2))
+    [1, 0, 2, 0]
+
+    """
+    if not isinstance(puzzle, basestring):
+        cells = bytearray(puzzle)
+    elif len(puzzle) == n**2 or (n <= len(sudoku._DIGITS) and
+                                 sudoku._SEPARATOR not in puzzle):
+        cells = bytearray(puzzle.translate(_CELL_VALUES))
+    else:
+        try:
+            cells = bytearray([int(digit) for digit in
+                               sudoku.grid_cells(puzzle, n)])
+        except ValueError:
+            raise ValueError('puzzle is not a valid %d x %d grid' % (n, n))
+    if len(cells) != n**2 or (cells and max(cells) > n):
+        raise ValueError('puzzle of %d cells is not a valid %d x %d grid'
+                         % (len(cells), n, n))
+    return cells
+
+def to_string(cells, n=None):
+    """Render a sequence of cell values as a grid string.
+
+    Grids of n > 35 are rendered in the delimited form of format_grid.
+
+    >>> to_string(bytearray([1, 0, 10]))
+    '10A'
+
+    """
+    if n > len(sudoku._DIGITS):
+        return sudoku.format_grid(bytearray(cells), n)
+    return str(bytearray(cells)).translate(_CELL_DIGITS)
+
+def encode(puzzle, n, bits=None):
+    """Return the record of puzzle, an n x n grid, as a string."""
+    if bits is None:
+        bits = cell_bits(n)
+    cells = to_cells(puzzle, n)
+    if bits == 8:
+        return str(cells)
+
+    if len(cells) % 2:
+        cells.append(0)
+    return str(bytearray([high << 4 | low for high, low in
+                          itertools.izip(cells[0::2], cells[1::2])]))
+
+def decode(record, n, bits=None):
+    """Return the cells of a record of an n x n grid as a bytearray.
+
+    >>> list(decode(encode('1020', 2), 2))
+    [1, 0, 2, 0]
+
+    """
+    if bits is None:
+        bits = cell_bits(n)
+    if bits == 8:
+        return bytearray(record)
+
+    cells = bytearray(''.join([_NIBBLES[byte]
+                               for byte in bytearray(record)]))
+    del cells[n**2:]
+    return cells
+
+################################### Writing ###################################
+
+class RecordWriter:
+    """Writes puzzles of one size to a file of records."""
+
+    def __init__(self, f, n=sudoku._N, boxWidth=sudoku._BOX_WIDTH,
+                 bits=None):
+        """Write the header of a record file to the open file f.
+
+        Keyword Arguments:
+
+        n, boxWidth: the size of every grid in the file.
+
+        bits: the bits per cell, 4 or 8. Defaults to a nibble if n <= 15.
+
+        """
+        if bits is None:
+            bits = cell_bits(n)
+        if bits not in (4, 8) or (bits == 4 and n > _NIBBLE_N):
+            raise ValueError('%s bits cannot hold the cells of a %d x %d '
+                             'grid' % (bits, n, n))
+
+        self.f = f
+        self.n = n
+        self.boxWidth = boxWidth
+        self.bits = bits
+        self.count = 0
+        f.write(_HEADER.pack(_MAGIC, _VERSION, n, boxWidth, bits))
+
+    def write(self, puzzle):
+        """Append the record of puzzle; raises ValueError if malformed."""
+        self.f.write(encode(puzzle, self.n, self.bits))
+        self.count += 1
+
+def write_records(path, puzzles, n=sudoku._N, boxWidth=sudoku._BOX_WIDTH,
+                  bits=None):
+    """Write the puzzles to a new record file at path.
+
+    Returns the number of puzzles written.
+
+    """
+    with open(path, 'wb') as f:
+        writer = RecordWriter(f, n, boxWidth, bits)
+        for puzzle in puzzles:
+            writer.write(puzzle)
+    return writer.count
+
+################################### Reading ###################################
+
+class RecordFile:
+    """A memory-mapped record file, indexed like a list of puzzles.
+
+    Indexing a RecordFile returns the cells of a puzzle in the form
+    set_grid takes: a buffer into the map itself with a byte per cell, or
+    a bytearray unpacked from it with a nibble per cell. Puzzles are not
+    read from disk until they are asked for.
+
+    """
+    def __init__(self, path):
+        """Map the record file at path, checking its header."""
+        self.path = path
+        self.file = open(path, 'rb')
+        try:
+            self.map = mmap.mmap(self.file.fileno(), 0,
+                                 access=mmap.ACCESS_READ)
+        except (ValueError, mmap.error):
+            self.file.close()
+            raise ValueError('%s is not a record file' % path)
+
+        try:
+            self.read_header()
+        except ValueError:
+            self.close()
+            raise
+
+    def read_header(self):
+        """Read the size of the grids and the number of records."""
+        if len(self.map) < _HEADER.size:
+            raise ValueError('%s is not a record file' % self.path)
+        magic, version, n, boxWidth, bits = _HEADER.unpack_from(self.map)
+        if magic != _MAGIC:
+            raise ValueError('%s is not a record file' % self.path)
+        if version != _VERSION:
+            raise ValueError('%s has version %d; only version %d is known'
+                             % (self.path, version, _VERSION))
+        if bits not in (4, 8):
+            raise ValueError('%s has %d bits per cell' % (self.path, bits))
+
+        self.n = n
+        self.boxWidth = boxWidth
+        self.bits = bits
+        self.recordSize = record_size(n, bits)
+
+        self.count, extra = divmod(len(self.map) - _HEADER.size,
+                                   self.recordSize)
+        if extra:
+            raise ValueError('%s ends with a partial record' % self.path)
+
+    def __len__(self):
+        return self.count
+
+    def record(self, index):
+        """Return the packed record of puzzle index as a buffer."""
+        if index < 0:
+            index += self.count
+        if not 0 <= index < self.count:
+            raise IndexError('record index out of range')
+        return buffer(self.map, _HEADER.size + index * self.recordSize,
+                      self.recordSize)
+
+    def __getitem__(self, index):
+        """Return the cells of puzzle index, as set_grid takes them."""
+        if self.bits == 8:
+            return self.record(index)
+        return decode(self.record(index), self.n, self.bits)
+
+    def __iter__(self):
+        for index in xrange(self.count):
+            yield self[index]
+
+    def puzzle(self, index):
+        """Return puzzle index as a grid string."""
+        return to_string(self[index], self.n)
+
+    def close(self):
+        """Unmap and close the file."""
+        self.map.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def solve_records(records, engine=sudoku._ENGINE):
+    """Yield the answer to each puzzle of the RecordFile records.
+
+    Answers are those of find_solutions: the unique solution, or the
+    puzzle itself. One matrix is built, and each puzzle is set on it in
+    turn.
+
+    """
+    matrix = sudoku.ENGINES[engine]("0" * records.n**2, records.n,
+                                    records.boxWidth)
+    for cells in records:
+        matrix.set_grid(cells)
+        solutions = matrix.solve()
+        if len(solutions) == 1:
+            yield solutions[0]
+        else:
+            yield to_string(cells, records.n)
+        if matrix.tainted:
+            # A contradictory grid leaves the links scrambled.
+            matrix = sudoku.ENGINES[engine]("0" * records.n**2, records.n,
+                                            records.boxWidth)
+
+def main(argv=None):
+    """Pack, unpack, or solve a file of puzzles."""
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    commands = parser.add_subparsers(dest='command')
+
+    pack = commands.add_parser('pack', help='write puzzles, one per line, '
+                                            'to a record file')
+    pack.add_argument('input', help="file of puzzles, or '-' for stdin")
+    pack.add_argument('output')
+    pack.add_argument('-n', type=int, default=sudoku._N)
+    pack.add_argument('--box-width', type=int, default=sudoku._BOX_WIDTH)
+    pack.add_argument('--bits', type=int, choices=(4, 8), default=None)
+
+    unpack = commands.add_parser('unpack', help='print the puzzles of a '
+                                                'record file')
+    unpack.add_argument('input')
+
+    solve = commands.add_parser('solve', help='print the answer to each '
+                                              'puzzle of a record file')
+    solve.add_argument('input')
+    solve.add_argument('--engine', default=sudoku._ENGINE,
+                       choices=sorted(sudoku.ENGINES))
+    args = parser.parse_args(argv)
+
+    if args.command == 'pack':
+        f = sys.stdin if args.input == '-' else open(args.input)
+        with open(args.output, 'wb') as out:
+            writer = RecordWriter(out, args.n, args.box_width, args.bits)
+            for number, line in enumerate(f):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    writer.write(line)
+                except ValueError, e:
+                    sys.stderr.write('line %d skipped: %s\n'
+                                     % (number + 1, e))
+        sys.stderr.write('%d puzzles packed\n' % writer.count)
+        return
+
+    with RecordFile(args.input) as records:
+        if args.command == 'unpack':
+            for index in xrange(len(records)):
+                print records.puzzle(index)
+        else:
+            for answer in solve_records(records, args.engine):
+                print answer
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,664 @@
+#!/usr/local/bin/python
+# -*- coding: utf-8 -*-
+
+"""Long-running HTTP front end for the Sudoku solver.
+
+Running sudoku.py as a CGI script pays for interpreter startup and
+matrix construction on every request. This module serves the same
+requests from a persistent process instead: it accepts the same
+original_grid, n, and boxWidth parameters, by GET or POST, and answers
+with the same body the CGI script prints.
+
+Requests are handled by a fixed pool of threads, optionally in several
+pre-forked worker processes sharing one listening socket. Connections
+are kept alive between requests, matrices for common grid sizes are
+built at boot, and SIGTERM or SIGINT lets in-flight requests finish
+before the server exits.
+
+A request may also carry a session parameter. The server then keeps
+the puzzle in a SolvingSession and applies only the cells which changed
+since that session's last request. The id of the session is returned
+in the X-Sudoku-Session header; an empty, unknown, or expired id starts
+a new session. Sessions live in the worker process which created them,
+so with several workers a session may be rebuilt by another process.
+
+Identical requests without a session which arrive while the first of
+them is still being searched share its search rather than starting
+their own. A request may also name its client, and number its requests
+with seq: a client's newer request cancels its older one, whose search
+is abandoned at its next checkpoint unless an identical request still
+waits for it. A cancelled request is answered with the original grid
+and an X-Sudoku-Superseded header.
+
+Within a session, each search after an edit tries the session's last
+solution first, so the typical re-solve finds its first solution with
+little backtracking. A request without a session may pass a grid to try
+first as its hint parameter, such as the answer to its previous request.
+
+A request without a session may carry a stats parameter. The counters
+and timings of its search are then returned as a JSON object in the
+X-Sudoku-Stats header; see SearchStats.
+
+The /candidates path takes the same parameters and answers, without
+searching, with the digits each cell may still take: a JSON object whose
+candidates list holds one bitmask per cell, bit k standing for digit
+k + 1, and whose forced list holds [row, col, digit] for every cell
+whose digit is already forced. With a propagate parameter, or a server
+started with --propagate, singles are filled in first, and the grid
+member holds the grid they were filled into. If that grid contradicts
+itself, candidates is null.
+
+With the array engines, the matrices warmed at boot can be restored
+from snapshots rather than built; see use_snapshots. Snapshots for the
+warmed sizes are written by a separate build step:
+
+    python sudoku_server.py --engine array --warm 25x5,30x5 \\
+        --snapshots /var/cache/sudoku --build-snapshots
+
+Usage:
+
+    python sudoku_server.py --port 8000 --workers 4 --threads 8
+
+>>> pool = sudoku.MatrixPool()
+>>> solve_params({'original_grid': sudoku._EMPTY_GRID}, pool) == sudoku._EMPTY_GRID
+True
+
+"""
+
+import os
+import sys
+import time
+import json
+import errno
+import traceback
+import signal
+import threading
+import Queue
+import BaseHTTPServer
+import SocketServer
+from urlparse import urlparse, parse_qs
+from collections import OrderedDict
+
+import sudoku
+
+# Paths answered with a solution. The web front end requests
+# cgi-bin/sudoku.py relative to the page.
+SOLVE_PATHS = ('/', '/solve', '/cgi-bin/sudoku.py')
+
+# Paths answered with the candidates of every cell.
+CANDIDATE_PATHS = ('/candidates',)
+
+# Grid sizes built before the first request, as (n, boxWidth).
+_WARM_SIZES = [(9, 3), (12, 4), (12, 3), (16, 4)]
+
+# Seconds an idle keep-alive connection is held open.
+_KEEPALIVE_TIMEOUT = 5
+
+# Default budget for each search: the number of search nodes and the
+# seconds of wall-clock time to spend before answering with the
+# original grid.
+_MAX_NODES = 1000000
+_TIME_LIMIT = 10.0
+
+# Number of solutions kept by the server's SolutionCache.
+_CACHE_SIZE = 10000
+
+# Number of clients whose latest request the Coordinator remembers.
+_MAX_CLIENTS = 10000
+
+# Seconds a request sharing another's search waits between checks of
+# whether it has been cancelled.
+_POLL = 0.05
+
+def deadline(timeLimit):
+    """Return the deadline timeLimit seconds from now, or None."""
+    if timeLimit is None:
+        return None
+    return time.time() + timeLimit
+
+def solve_params(params, pool, propagate=False, maxNodes=None,
+                 timeLimit=None, cache=None, stats=None, cancel=None):
+    """Solve the grid described by the dict of request parameters.
+
+    Searches which visit more than maxNodes nodes or run longer than
+    timeLimit seconds, or whose cancel Event is set, are abandoned. The
+    SolutionCache cache, if any, is consulted first, and the dict stats,
+    if any, is filled in as by find_solutions. Like the CGI script, any
+    failure answers with the original grid; the error is logged to
+    stderr.
+
+    """
+    original_grid = params['original_grid']
+    try:
+        n = int(params.get('n', sudoku._N))
+        boxWidth = int(params.get('boxWidth', sudoku._BOX_WIDTH))
+        return sudoku.find_solutions(original_grid, n, boxWidth,
+                                     pool=pool, propagate=propagate,
+                                     maxNodes=maxNodes,
+                                     deadline=deadline(timeLimit),
+                                     cache=cache, stats=stats,
+                                     cancel=cancel,
+                                     hint=params.get('hint'))
+    except Exception:
+        traceback.print_exc(file=sys.stderr)
+        return original_grid
+
+def candidates_params(params, pool, propagate=False):
+    """Describe the candidates of the grid described by params, as JSON.
+
+    A propagate parameter, or propagate, fills in singles first; see
+    pencil_marks. Any failure answers with null candidates; the error is
+    logged to stderr.
+
+    >>> body = json.loads(candidates_params(
+    ...     {'original_grid': '12345678' + '0'*73}, sudoku.MatrixPool()))
+    >>> body['candidates'][8], body['forced']
+    (256, [[0, 8, 9]])
+
+    """
+    original_grid = params['original_grid']
+    answer = {'grid': original_grid, 'candidates': None, 'forced': []}
+    try:
+        n = int(params.get('n', sudoku._N))
+        boxWidth = int(params.get('boxWidth', sudoku._BOX_WIDTH))
+        marks = sudoku.pencil_marks(original_grid, n, boxWidth, pool=pool,
+                                    propagate=propagate or
+                                              'propagate' in params)
+        if marks is not None:
+            grid, masks, forced = marks
+            answer = {'grid': grid, 'candidates': masks, 'forced': forced}
+    except Exception:
+        traceback.print_exc(file=sys.stderr)
+    return json.dumps(answer, sort_keys=True)
+
+def solve_session(params, sessions, maxNodes=None, timeLimit=None):
+    """Solve the grid described by params in the session it names.
+
+    Returns a tuple (body, sessionId).
+
+    >>> sessions = sudoku.SessionStore()
+    >>> body, sessionId = solve_session({'original_grid': '0'*81,
+    ...                                  'session': ''}, sessions)
+    >>> body == '0'*81, sessions.get(sessionId) is not None
+    (True, True)
+
+    """
+    original_grid = params['original_grid']
+    try:
+        n = int(params.get('n', sudoku._N))
+        boxWidth = int(params.get('boxWidth', sudoku._BOX_WIDTH))
+    except ValueError:
+        return original_grid, params['session']
+
+    sessionId = params['session']
+    session = sessions.get(sessionId)
+    if (session is None or session.n != n or session.boxWidth != boxWidth):
+        sessionId = sessions.create(n, boxWidth)
+        session = sessions.get(sessionId)
+
+    try:
+        with session.lock:
+            session.update(original_grid)
+            return (session.result(maxNodes, deadline(timeLimit)),
+                    sessionId)
+    except Exception:
+        traceback.print_exc(file=sys.stderr)
+        # Start afresh next time rather than trust a half-applied update.
+        sessions.discard(sessionId)
+        return original_grid, sessionId
+
+def parse_sizes(s):
+    """Parse a list of grid sizes such as '9x3,16x4'.
+
+    >>> parse_sizes('9x3,16x4')
+    [(9, 3), (16, 4)]
+
+    """
+    sizes = []
+    for size in s.split(','):
+        if size:
+            n, boxWidth = size.split('x')
+            sizes.append((int(n), int(boxWidth)))
+    return sizes
+
+################################# Coalescing ##################################
+
+class Flight:
+    """A search shared by identical requests.
+
+    A Flight stands in for the cancel Event of its search: it is set
+    once every request waiting for it has been cancelled.
+
+    """
+    def __init__(self):
+        self.done = threading.Event()
+        self.body = None
+        self.tokens = []
+
+    def is_set(self):
+        """Return True if every request waiting for the search is gone."""
+        return all(token.is_set() for token in self.tokens)
+
+class Coordinator:
+    """Shares searches between identical requests and cancels old ones.
+
+    Each request is given a token, a threading.Event set once the
+    request is superseded by a newer one from the same client.
+
+    >>> coordinator = Coordinator()
+    >>> old = coordinator.register('tab', '1')
+    >>> new = coordinator.register('tab', '2')
+    >>> old.is_set(), new.is_set()
+    (True, False)
+    >>> coordinator.register('tab', '1').is_set()
+    True
+    >>> coordinator.solve('grid', new, lambda cancel: 'answer')
+    'answer'
+    >>> coordinator.release('tab', new)
+    >>> coordinator.register('tab', '1').is_set()
+    True
+
+    Only the maxClients clients heard from most recently are remembered:
+
+    >>> coordinator = Coordinator(maxClients=1)
+    >>> token = coordinator.register('tab', '2')
+    >>> token = coordinator.register('other', '1')
+    >>> coordinator.clients.keys()
+    ['other']
+
+    """
+    def __init__(self, maxClients=_MAX_CLIENTS):
+        """Create a Coordinator remembering up to maxClients clients."""
+        self.lock = threading.Lock()
+        self.maxClients = maxClients
+
+        # Maps the key of each search in progress to its Flight.
+        self.flights = {}
+
+        # Maps each client to the seq and token of its latest request; the
+        # token is None once that request has been answered. The least
+        # recently heard from client comes first.
+        self.clients = OrderedDict()
+
+        # Requests which shared another's search, and requests cancelled.
+        self.coalesced = 0
+        self.cancelled = 0
+
+    def register(self, client, seq=None):
+        """Return the token of a new request from client.
+
+        The token of the client's previous request is set. If the client
+        has already sent a request with a higher seq, the new request is
+        superseded from the start.
+
+        """
+        token = threading.Event()
+        if client is None:
+            return token
+        try:
+            seq = int(seq)
+        except (TypeError, ValueError):
+            seq = None
+
+        with self.lock:
+            latest = self.clients.pop(client, None)
+            if latest is not None:
+                latestSeq, latestToken = latest
+                if (seq is not None and latestSeq is not None and
+                    seq < latestSeq):
+                    self.clients[client] = latest
+                    self.cancelled += 1
+                    token.set()
+                    return token
+                if latestToken is not None and not latestToken.is_set():
+                    self.cancelled += 1
+                    latestToken.set()
+            self.clients[client] = (seq, token)
+
+            while len(self.clients) > self.maxClients:
+                self.clients.popitem(last=False)
+        return token
+
+    def release(self, client, token):
+        """Forget the request with token once it has been answered.
+
+        The client's seq is kept, so that an older request arriving late
+        is still superseded.
+
+        """
+        with self.lock:
+            latest = self.clients.get(client)
+            if latest is not None and latest[1] is token:
+                self.clients[client] = (latest[0], None)
+
+    def solve(self, key, token, compute):
+        """Return compute(cancel), sharing it with identical requests.
+
+        If a search for key is already in flight, its answer is awaited
+        instead. Returns None if token is set before the answer arrives.
+
+        """
+        with self.lock:
+            flight = self.flights.get(key)
+            leader = flight is None or flight.is_set()
+            if leader:
+                # A search every requester has given up on is no use.
+                flight = Flight()
+                self.flights[key] = flight
+            else:
+                self.coalesced += 1
+            flight.tokens.append(token)
+
+        if not leader:
+            while not flight.done.wait(_POLL):
+                if token.is_set():
+                    return None
+            return flight.body
+
+        try:
+            flight.body = compute(flight)
+        finally:
+            with self.lock:
+                if self.flights.get(key) is flight:
+                    del self.flights[key]
+            flight.done.set()
+        if token.is_set():
+            return None
+        return flight.body
+
+################################### Handler ###################################
+
+class SolverHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Answers solve requests on a keep-alive connection."""
+
+    # HTTP/1.1 keeps connections open between requests.
+    protocol_version = 'HTTP/1.1'
+    timeout = _KEEPALIVE_TIMEOUT
+
+    def do_GET(self):
+        """Solve the grid given in the query string."""
+        url = urlparse(self.path)
+        self.dispatch(url.path, parse_qs(url.query, True))
+
+    def do_POST(self):
+        """Solve the grid given in the form-encoded request body."""
+        length = int(self.headers.getheader('content-length', 0))
+        params = parse_qs(self.rfile.read(length), True)
+        self.dispatch(urlparse(self.path).path, params)
+
+    def dispatch(self, path, params):
+        """Answer the request for path with the given parameters."""
+        # parse_qs maps each name to a list; keep the first, like getfirst.
+        params = dict((k, v[0]) for k, v in params.iteritems())
+
+        if path not in SOLVE_PATHS and path not in CANDIDATE_PATHS:
+            self.respond(404, 'Not Found\n')
+        elif 'original_grid' not in params:
+            self.respond(400, 'Missing original_grid\n')
+        elif path in CANDIDATE_PATHS:
+            body = candidates_params(params, self.server.pool,
+                                     self.server.propagate)
+            self.respond(200, body + '\n')
+        elif 'session' in params:
+            body, sessionId = solve_session(params, self.server.sessions,
+                                            self.server.maxNodes,
+                                            self.server.timeLimit)
+            self.respond(200, body + '\n',
+                         {'X-Sudoku-Session': sessionId})
+        else:
+            stats = None
+            if 'stats' in params:
+                stats = {}
+            body, superseded = self.solve(params, stats)
+            headers = {}
+            if stats:
+                headers['X-Sudoku-Stats'] = json.dumps(stats, sort_keys=True)
+            if superseded:
+                headers['X-Sudoku-Superseded'] = '1'
+            self.respond(200, body + '\n', headers)
+
+    def solve(self, params, stats=None):
+        """Solve the request, sharing or cancelling its search as asked.
+
+        Returns a tuple (body, superseded). Requests asking for stats get
+        a search of their own.
+
+        """
+        server = self.server
+        coordinator = server.coordinator
+        client = params.get('client')
+        token = coordinator.register(client, params.get('seq'))
+
+        def compute(cancel):
+            return solve_params(params, server.pool, server.propagate,
+                                server.maxNodes, server.timeLimit,
+                                server.cache, stats, cancel)
+
+        try:
+            if token.is_set():
+                body = None
+            elif stats is not None:
+                body = compute(token)
+            else:
+                key = (params['original_grid'],
+                       params.get('n', str(sudoku._N)),
+                       params.get('boxWidth', str(sudoku._BOX_WIDTH)))
+                body = coordinator.solve(key, token, compute)
+        finally:
+            coordinator.release(client, token)
+
+        if body is None:
+            body = params['original_grid']
+        return body, token.is_set()
+
+    def respond(self, code, body, headers={}):
+        """Send body with a Content-Length so the connection can persist."""
+        self.send_response(code)
+        for name, value in headers.iteritems():
+            self.send_header(name, value)
+        self.send_header('Content-Type', 'text/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        """Log requests unless the server is quiet."""
+        if not self.server.quiet:
+            BaseHTTPServer.BaseHTTPRequestHandler.log_message(
+                self, format, *args)
+
+################################### Server ####################################
+
+class ThreadPoolMixIn:
+    """Mix-in class to handle each request with a fixed pool of threads.
+
+    Accepted connections wait in a bounded queue, so a burst of requests
+    blocks the accept loop instead of spawning unbounded threads.
+
+    """
+    threads = 8
+
+    def start_workers(self):
+        """Start the worker threads."""
+        self.requests = Queue.Queue(4 * self.threads)
+        self.workers = []
+        for i in xrange(self.threads):
+            worker = threading.Thread(target=self.process_request_thread)
+            worker.daemon = True
+            worker.start()
+            self.workers.append(worker)
+
+    def stop_workers(self, timeout=None):
+        """Let the workers finish their requests, then stop them."""
+        for worker in self.workers:
+            self.requests.put(None)
+        for worker in self.workers:
+            worker.join(timeout)
+
+    def process_request(self, request, client_address):
+        """Queue the request for the next free worker."""
+        self.requests.put((request, client_address))
+
+    def process_request_thread(self):
+        """Handle queued requests until stop_workers is called."""
+        while True:
+            item = self.requests.get()
+            if item is None:
+                return
+
+            request, client_address = item
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+class SolverServer(ThreadPoolMixIn, BaseHTTPServer.HTTPServer):
+    """An HTTP server holding a MatrixPool shared by its threads."""
+
+    allow_reuse_address = True
+
+    def __init__(self, address, threads=ThreadPoolMixIn.threads,
+                 engine=sudoku._ENGINE, propagate=False, quiet=False,
+                 sessionTimeout=600, maxNodes=_MAX_NODES,
+                 timeLimit=_TIME_LIMIT, cacheSize=_CACHE_SIZE):
+        """Bind the server to address and build its MatrixPool."""
+        BaseHTTPServer.HTTPServer.__init__(self, address, SolverHandler)
+        self.threads = threads
+        self.propagate = propagate
+        self.maxNodes = maxNodes
+        self.timeLimit = timeLimit
+        self.quiet = quiet
+        self.pool = sudoku.MatrixPool(engine, maxIdle=threads)
+        self.sessions = sudoku.SessionStore(sessionTimeout, pool=self.pool)
+        self.coordinator = Coordinator()
+        self.cache = None
+        if cacheSize > 0:
+            self.cache = sudoku.SolutionCache(cacheSize)
+
+    def run(self):
+        """Serve until SIGTERM or SIGINT, then drain in-flight requests."""
+        def stop(signum, frame):
+            # shutdown blocks until serve_forever returns, so it cannot
+            # be called from the thread running serve_forever.
+            threading.Thread(target=self.shutdown).start()
+
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+
+        self.start_workers()
+        try:
+            while True:
+                try:
+                    self.serve_forever()
+                    break
+                except (IOError, OSError, SocketServer.socket.error), e:
+                    # A signal interrupted select; keep serving.
+                    if e.args[0] != errno.EINTR:
+                        raise
+        finally:
+            self.stop_workers(_KEEPALIVE_TIMEOUT)
+            self.server_close()
+
+def serve_preforked(server, workers):
+    """Fork workers processes which all accept on server's socket."""
+    # Every worker wakes for each connection; those which lose the race
+    # to accept must not block.
+    server.socket.setblocking(0)
+
+    children = []
+    for i in xrange(workers):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                server.run()
+            finally:
+                os._exit(0)
+        children.append(pid)
+
+    def stop(signum, frame):
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except OSError, e:
+            if e.errno == errno.EINTR:
+                continue
+            raise
+        children.remove(pid)
+    server.server_close()
+
+def main(argv=None):
+    """Parse the command line and run the server."""
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--host', default='')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of pre-forked processes')
+    parser.add_argument('--threads', type=int,
+                        default=ThreadPoolMixIn.threads,
+                        help='number of threads per process')
+    parser.add_argument('--engine', default=sudoku._ENGINE,
+                        choices=sorted(sudoku.ENGINES))
+    parser.add_argument('--propagate', action='store_true',
+                        help='fill in singles before searching')
+    parser.add_argument('--warm', type=parse_sizes,
+                        default=_WARM_SIZES,
+                        help='grid sizes to build at boot, e.g. 9x3,16x4')
+    parser.add_argument('--session-timeout', type=int, default=600,
+                        help='seconds before an idle session expires')
+    parser.add_argument('--max-nodes', type=int, default=_MAX_NODES,
+                        help='search nodes to visit before giving up')
+    parser.add_argument('--time-limit', type=float, default=_TIME_LIMIT,
+                        help='seconds to search before giving up')
+    parser.add_argument('--cache-size', type=int, default=_CACHE_SIZE,
+                        help='solutions to cache by canonical form; 0 '
+                             'disables the cache')
+    parser.add_argument('--snapshots', default=None,
+                        help='directory of matrix snapshots to restore '
+                             'array engine matrices from')
+    parser.add_argument('--build-snapshots', action='store_true',
+                        help='write snapshots of the warmed sizes to the '
+                             'snapshot directory and exit')
+    parser.add_argument('--quiet', action='store_true')
+    args = parser.parse_args(argv)
+
+    if args.build_snapshots:
+        if args.snapshots is None:
+            parser.error('--build-snapshots requires --snapshots')
+        for n, boxWidth in args.warm:
+            try:
+                print sudoku.write_snapshot(args.snapshots, n, boxWidth,
+                                            args.engine)
+            except ValueError, e:
+                parser.error(str(e))
+        return
+    if args.snapshots is not None:
+        sudoku.use_snapshots(args.snapshots)
+
+    server = SolverServer((args.host, args.port), args.threads,
+                          args.engine, args.propagate, args.quiet,
+                          args.session_timeout, args.max_nodes,
+                          args.time_limit, args.cache_size)
+
+    # Matrices built before forking are shared by every worker.
+    server.pool.warm(args.warm)
+
+    if args.workers > 1:
+        serve_preforked(server, args.workers)
+    else:
+        server.run()
+
+if __name__ == "__main__":
+    main()